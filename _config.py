@@ -3,14 +3,54 @@ API_HASH = ""  # Telegram API Hash
 BOT_TOKEN = ""  # Telegram Bot Token
 OWNER_ID = "" # Telegram Owner ID
 
-ALLOWED_USERS = {0000000000,0000000000}  # Beyaz liste kullanıcılar
+ALLOWED_USERS = {0000000000,0000000000}  # Beyaz liste kullanıcılar (first run only, then managed with /sudo and /unsudo in DB_PATH)
 LOG_CHANNEL_ID = -100   # Commands and upload log channel
 PROGRESS_UPDATE_INTERVAL = 7   # Refresh progress every 7 seconds
 EQUAL_SPLIT = False   # Equal splits over 2 GB
 
 YOUTUBE_API_KEY = ""    # Youtube Data Api V3 key for video search feature
-COOKIES_URL = ""   # Cookies.txt download url (optional)
+COOKIES_URL = ""   # Cookies.txt download url (optional), a list of urls rotates between accounts
 PLACEHOLDER_AUDIO_URL = "" # Placeholder mp3 url (not necessary)
 
 AV1_FOR_LOWRES = True  # AV1 enabled for 144p, 240p, 360p, 480p
 AV1_FOR_HIGHRES = True  # AV1 enabled for 720p, 1080p, 1440p, 2160p, 3840p
+
+YTDL_POOL_SIZE = 4  # Long-lived YoutubeDL instances reused for metadata extraction (downloads are not limited by it)
+YTDL_CACHE_DIR = "ytdlp-cache"  # Persistent yt-dlp cache (player/signature data)
+PLAYLIST_MAX_ENTRIES = 200  # Maximum number of entries processed from a playlist/channel
+PLAYLIST_CONCURRENCY = 2  # Playlist entries downloaded/uploaded in parallel
+UPLOAD_CACHE_FILE = "upload_cache.json"  # Log channel message ids of already uploaded entries
+
+DB_PATH = "bot.db"  # SQLite database for usage accounting and quotas
+MAX_CONCURRENT_JOBS = 2  # Jobs running at the same time, the rest wait in fair-share order
+DAILY_QUOTA_GB = 0  # Default daily download quota per user, 0 = unlimited
+HEAVY_USER_GB = 5  # Users above this daily download volume are rate limited when the system is busy
+HEAVY_USER_RATELIMIT = 2 * 1024 * 1024  # Download rate limit for heavy users (bytes/s)
+
+WORK_DIR = "downloads"  # Per-job work directories, kept after a failure so a retry can resume
+RETRY_GRACE_SECONDS = 30 * 60  # How long failed jobs can be retried before their files are removed
+DOWNLOAD_RETRIES = 3  # Download attempts retried with exponential backoff
+UPLOAD_RETRIES = 3  # Upload attempts per part retried with exponential backoff
+RETRY_BACKOFF_BASE = 5  # Backoff base in seconds (5, 10, 20, ...)
+
+TRANSCODE_THREADS = 2  # ffmpeg threads per "compatible" (H.264/AAC) transcode job
+TRANSCODE_WORKERS = 0  # Parallel transcodes, 0 = CPU cores / TRANSCODE_THREADS
+TRANSCODE_NICE = 10  # Niceness of transcode processes so downloads/uploads are not starved
+TRANSCODE_PRESET = "veryfast"  # libx264 preset
+TRANSCODE_CRF = 23  # libx264 quality (lower is better)
+
+COOKIE_FILES = []  # Local cookies.txt files of additional accounts, rotated together with COOKIES_URL
+COOKIES_DIR = "cookies"  # Where cookies downloaded from COOKIES_URL are stored
+COOKIES_REFRESH_INTERVAL = 6 * 60 * 60  # Background cookie refresh interval (seconds), /cookies reload forces it
+COOKIE_BACKOFF_SECONDS = 15 * 60  # First rest period of an account throttled by YouTube, doubles on repeat
+
+SUBTITLE_LANGS = ["tr", "en"]  # Subtitle languages offered for embedding in the quality menu
+CHAPTER_UPLOAD_CONCURRENCY = 2  # Chapters uploaded in parallel when a video is sent chapter by chapter
+
+USERBOT_SESSION_STRING = ""  # Premium account session string, files above 2 GB are uploaded with it to LOG_CHANNEL_ID (optional)
+USERBOT_MAX_FILE_SIZE = 4194304000  # Upload limit of the premium account (4000 MB)
+
+PREFETCH_RESULTS = 3  # Top search results whose metadata is fetched in the background, 0 = off
+PREFETCH_WORKERS = 2  # Low priority prefetch threads
+PREFETCH_CACHE_SIZE = 20  # Prefetched video infos kept in memory
+PREFETCH_TTL = 5 * 60  # Seconds a prefetched video info stays valid
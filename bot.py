@@ -1,19 +1,33 @@
 import os
 import sys
+import functools
+import signal
+import hashlib
+import shutil
 import re
 import time
 import logging
 import tempfile
-import yt_dlp
-import ffmpeg
-import requests
+import importlib
 import subprocess
 import glob
 import threading
 import copy
 import math
-from pyrogram import Client, filters, types
-from PIL import Image
+import queue
+import contextlib
+import itertools
+import concurrent.futures
+import sqlite3
+import heapq
+import collections
+import urllib.parse
+
+# Açılış süresi pyrogram ve config yüklenmeden önce ölçülmeye başlanır
+startup_started = time.monotonic()
+
+from pyrogram import Client, filters, types, idle
+from pyrogram.errors import FloodWait
 from config import (
     API_ID,
     API_HASH,
@@ -28,37 +42,663 @@ from config import (
     AV1_FOR_LOWRES,
     AV1_FOR_HIGHRES    # Yeni: Youtube Data API anahtarı
 )
+import config
 import json
 
+class LazyModule:
+    """
+    Modülü ilk öznitelik erişiminde içe aktaran vekil. yt-dlp, ffmpeg, requests ve PIL
+    bot açılışını yavaşlattığı için ilk kullanıldıkları ana (veya ön ısıtmaya) ertelenir.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.monotonic()
+                    self._module = importlib.import_module(self._name)
+                    logging.getLogger(__name__).info(
+                        "%s modülü %.2f saniyede yüklendi.", self._name, time.monotonic() - started
+                    )
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+yt_dlp = LazyModule("yt_dlp")
+ffmpeg = LazyModule("ffmpeg")
+requests = LazyModule("requests")
+Image = LazyModule("PIL.Image")
+
 # Eğer PROGRESS_UPDATE_INTERVAL tanımlı değilse varsayılan 7 saniye.
 if not PROGRESS_UPDATE_INTERVAL:
     PROGRESS_UPDATE_INTERVAL = 7
 
+# Eski config.py dosyalarıyla uyumluluk için yeni ayarlar varsayılan değerlerle okunuyor.
+YTDL_POOL_SIZE = getattr(config, "YTDL_POOL_SIZE", 4)
+YTDL_CACHE_DIR = getattr(config, "YTDL_CACHE_DIR", "ytdlp-cache")
+PLAYLIST_MAX_ENTRIES = getattr(config, "PLAYLIST_MAX_ENTRIES", 200)
+PLAYLIST_CONCURRENCY = getattr(config, "PLAYLIST_CONCURRENCY", 2)
+UPLOAD_CACHE_FILE = getattr(config, "UPLOAD_CACHE_FILE", "upload_cache.json")
+DB_PATH = getattr(config, "DB_PATH", "bot.db")
+MAX_CONCURRENT_JOBS = getattr(config, "MAX_CONCURRENT_JOBS", 2)
+DAILY_QUOTA_GB = getattr(config, "DAILY_QUOTA_GB", 0)
+HEAVY_USER_GB = getattr(config, "HEAVY_USER_GB", 5)
+HEAVY_USER_RATELIMIT = getattr(config, "HEAVY_USER_RATELIMIT", 2 * 1024 * 1024)
+WORK_DIR = getattr(config, "WORK_DIR", "downloads")
+RETRY_GRACE_SECONDS = getattr(config, "RETRY_GRACE_SECONDS", 30 * 60)
+DOWNLOAD_RETRIES = getattr(config, "DOWNLOAD_RETRIES", 3)
+UPLOAD_RETRIES = getattr(config, "UPLOAD_RETRIES", 3)
+RETRY_BACKOFF_BASE = getattr(config, "RETRY_BACKOFF_BASE", 5)
+TRANSCODE_THREADS = getattr(config, "TRANSCODE_THREADS", 2)
+TRANSCODE_WORKERS = getattr(config, "TRANSCODE_WORKERS", 0) or max(1, (os.cpu_count() or 1) // max(1, TRANSCODE_THREADS))
+TRANSCODE_NICE = getattr(config, "TRANSCODE_NICE", 10)
+TRANSCODE_PRESET = getattr(config, "TRANSCODE_PRESET", "veryfast")
+TRANSCODE_CRF = getattr(config, "TRANSCODE_CRF", 23)
+COOKIE_FILES = getattr(config, "COOKIE_FILES", [])
+COOKIES_DIR = getattr(config, "COOKIES_DIR", "cookies")
+COOKIES_REFRESH_INTERVAL = getattr(config, "COOKIES_REFRESH_INTERVAL", 6 * 60 * 60)
+COOKIE_BACKOFF_SECONDS = getattr(config, "COOKIE_BACKOFF_SECONDS", 15 * 60)
+USERBOT_SESSION_STRING = getattr(config, "USERBOT_SESSION_STRING", "")
+USERBOT_MAX_FILE_SIZE = getattr(config, "USERBOT_MAX_FILE_SIZE", 4194304000)
+PREFETCH_RESULTS = getattr(config, "PREFETCH_RESULTS", 3)
+PREFETCH_WORKERS = getattr(config, "PREFETCH_WORKERS", 2)
+PREFETCH_CACHE_SIZE = getattr(config, "PREFETCH_CACHE_SIZE", 20)
+PREFETCH_TTL = getattr(config, "PREFETCH_TTL", 5 * 60)
+SUBTITLE_LANGS = getattr(config, "SUBTITLE_LANGS", ["tr", "en"])
+CHAPTER_UPLOAD_CONCURRENCY = getattr(config, "CHAPTER_UPLOAD_CONCURRENCY", 2)
+
 # Loglama ayarları
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
-# COOKIES_URL varsa cookies.txt indiriliyor.
-if COOKIES_URL:
-    try:
-        response = requests.get(COOKIES_URL)
-        with open("cookies.txt", "wb") as f:
-            f.write(response.content)
-        logger.info("cookies.txt başarıyla indirildi.")
-    except Exception as e:
-        logger.error("Cookies dosyası indirilemedi: %s", e)
-
 # Bot istemcisi
 app = Client("my_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 
+# Botların yükleyebildiği en büyük dosya boyutu (2000 MB)
+BOT_MAX_FILE_SIZE = 2097152000
+
+# Premium kullanıcı hesabı: 2 GB'dan büyük dosyaları LOG_CHANNEL'a yükler, bot mesajı kullanıcıya kopyalar
+userbot = Client(
+    "userbot", api_id=API_ID, api_hash=API_HASH, session_string=USERBOT_SESSION_STRING, no_updates=True
+) if USERBOT_SESSION_STRING and LOG_CHANNEL_ID else None
+userbot_max_file_size = 0  # Premium olduğu doğrulanınca USERBOT_MAX_FILE_SIZE olur
+
+def start_userbot():
+    """Premium hesabı başlatır; hesap premium değilse veya kanala erişemiyorsa kullanılmaz."""
+    global userbot_max_file_size
+    if userbot is None:
+        return
+    try:
+        userbot.start()
+        if not userbot.get_me().is_premium:
+            logger.warning("USERBOT_SESSION_STRING hesabı premium değil, büyük dosya yüklemesi kapalı.")
+            return
+        try:
+            userbot.get_chat(LOG_CHANNEL_ID)
+        except Exception:
+            # Kanal henüz oturumun önbelleğinde değilse diyaloglardan öğrenilir
+            for _ in userbot.get_dialogs():
+                pass
+            userbot.get_chat(LOG_CHANNEL_ID)
+        userbot_max_file_size = USERBOT_MAX_FILE_SIZE
+        logger.info("Premium hesap hazır, %d MB'a kadar dosyalar bölünmeden yüklenecek.", userbot_max_file_size // (1024 * 1024))
+    except Exception as e:
+        logger.error("Premium hesap başlatılamadı: %s", e)
+
 # Her kullanıcının video/ses bilgileri burada tutuluyor.
 user_video_info = {}  # user_id -> {url, title, duration, formats, thumbnail, ...}
+pending_links = {}  # user_id -> video mu liste mi olduğu sorulan link
 # Aynı anda sadece 1 işlem yapılsın:
 user_busy = {}       # user_id -> bool
 user_queue = {}      # user_id -> list of task dict'leri
 
+# YouTube'un hesabı geçici olarak kısıtladığını gösteren hata metinleri
+THROTTLE_MARKERS = ("HTTP Error 429", "Too Many Requests", "confirm you're not a bot", "confirm you’re not a bot")
+
+class CookieAccount:
+    """Tek bir hesabın çerez kaynağı (URL veya dosya), yüklenmiş çerezleri ve bekleme durumu."""
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.source = source
+        self.jar = None
+        self.mtime = None
+        self.failures = 0
+        self.cooldown_until = 0
+        self.last_used = 0
+
+    @property
+    def is_url(self) -> bool:
+        return self.source.startswith(("http://", "https://"))
+
+class CookieManager:
+    """
+    COOKIES_URL ve COOKIE_FILES'taki hesapların çerezlerini arka planda yeniler ve bellekte tutar.
+    Her yt-dlp işi sıradaki uygun hesabın çerezleriyle çalışır; YouTube bir hesabı kısıtladığında
+    (429 veya bot doğrulaması) o hesap artan sürelerle dinlendirilir.
+    """
+
+    def __init__(self):
+        urls = COOKIES_URL if isinstance(COOKIES_URL, (list, tuple)) else [COOKIES_URL]
+        sources = [url for url in urls if url] + list(COOKIE_FILES)
+        if not sources and os.path.exists("cookies.txt"):
+            sources = ["cookies.txt"]
+        self.accounts = [CookieAccount(f"hesap{i}", source) for i, source in enumerate(sources, start=1)]
+        self._lock = threading.Lock()
+        self._refresh_now = threading.Event()
+
+    def _fetch(self, account: CookieAccount):
+        """
+        Hesabın çerez dosyasını (gerekirse indirerek) hazırlar ve (yol, mtime) döner; dosya değişmediyse None döner.
+        account.mtime burada değil, çerezler başarıyla yüklendikten sonra güncellenir.
+        """
+        if account.is_url:
+            response = requests.get(account.source, timeout=30)
+            response.raise_for_status()
+            os.makedirs(COOKIES_DIR, exist_ok=True)
+            path = os.path.join(COOKIES_DIR, f"{account.name}.txt")
+            with open(path + ".tmp", "wb") as f:
+                f.write(response.content)
+            os.replace(path + ".tmp", path)
+            return path, None
+        mtime = os.path.getmtime(account.source)
+        if mtime == account.mtime:
+            return None
+        return account.source, mtime
+
+    @staticmethod
+    def _validate(jar) -> bool:
+        """Süresi dolmamış en az bir YouTube çerezi olmalı."""
+        now = time.time()
+        return any(
+            cookie.domain.endswith("youtube.com") and (not cookie.expires or cookie.expires > now)
+            for cookie in jar
+        )
+
+    def refresh(self):
+        for account in self.accounts:
+            try:
+                fetched = self._fetch(account)
+                if fetched is None:
+                    continue
+                path, mtime = fetched
+                jar = yt_dlp.cookies.YoutubeDLCookieJar(path)
+                jar.load(ignore_discard=True, ignore_expires=True)
+                if not self._validate(jar):
+                    logger.warning("%s çerezleri geçersiz veya süresi dolmuş, eski çerezler korunuyor.", account.name)
+                    continue
+                # Referans tek seferde değiştirilir, çalışan işler eski çerezlerle devam eder
+                account.jar = jar
+                # Geçersiz dosya bir sonraki turda yeniden denensin diye yalnızca başarıda işaretlenir
+                account.mtime = mtime
+                logger.info("%s çerezleri yüklendi (%d çerez).", account.name, len(jar))
+            except Exception as e:
+                logger.error("%s çerezleri yenilenemedi: %s", account.name, e)
+
+    def run(self):
+        while True:
+            self.refresh()
+            self._refresh_now.wait(COOKIES_REFRESH_INTERVAL)
+            self._refresh_now.clear()
+
+    def request_refresh(self):
+        self._refresh_now.set()
+
+    def pick(self):
+        """Dinlenmede olmayan ve en uzun süredir kullanılmayan hesabı seçer."""
+        now = time.time()
+        with self._lock:
+            ready = [a for a in self.accounts if a.jar is not None and a.cooldown_until <= now]
+            if not ready:
+                # Hepsi dinleniyorsa en erken açılacak hesap kullanılır
+                ready = sorted((a for a in self.accounts if a.jar is not None), key=lambda a: a.cooldown_until)[:1]
+            if not ready:
+                return None
+            account = min(ready, key=lambda a: a.last_used)
+            account.last_used = now
+            return account
+
+    def report(self, account: CookieAccount, error: Exception = None):
+        if account is None:
+            return
+        with self._lock:
+            if error is not None and any(marker in str(error) for marker in THROTTLE_MARKERS):
+                wait = COOKIE_BACKOFF_SECONDS * 2 ** min(account.failures, 5)
+                account.failures += 1
+                account.cooldown_until = time.time() + wait
+                logger.warning("%s YouTube tarafından kısıtlandı, %d sn dinlendirilecek.", account.name, wait)
+            elif error is None:
+                account.failures = 0
+
+    @staticmethod
+    def install(ydl, account: CookieAccount):
+        """
+        Örneğin çerez kavanozunu hesabın çerezleriyle doldurur.
+        yt-dlp'nin istek yöneticisi aynı kavanoz nesnesini kullandığı için nesne değiştirilmez.
+        """
+        ydl.cookiejar.clear()
+        if account is not None:
+            for cookie in account.jar:
+                ydl.cookiejar.set_cookie(cookie)
+
+    def status(self) -> str:
+        now = time.time()
+        lines = []
+        for account in self.accounts:
+            state = "yüklenmedi" if account.jar is None else f"{len(account.jar)} çerez"
+            if account.cooldown_until > now:
+                state += f", {int(account.cooldown_until - now)} sn dinlenmede"
+            lines.append(f"{account.name}: {state}")
+        return "\n".join(lines) or "Tanımlı çerez hesabı yok."
+
+cookie_manager = CookieManager()
+
+@contextlib.contextmanager
+def cookie_session(ydl):
+    """Örneğe sıradaki çerez hesabını yükler ve işin sonucunu hesaba bildirir."""
+    account = cookie_manager.pick()
+    cookie_manager.install(ydl, account)
+    try:
+        yield ydl
+    except Exception as e:
+        cookie_manager.report(account, e)
+        raise
+    cookie_manager.report(account)
+
+class YoutubeDLPool:
+    """
+    Bilgi çıkarma (indirmesiz extract_info) için uzun ömürlü yt_dlp.YoutubeDL örneklerini işler arasında paylaştırır.
+    Örnekler seçenek profiline göre ayrı tutulur ve hiç yeniden yapılandırılmaz; ödünç alındığı sürece
+    yalnızca o iş parçacığı kullanır. Böylece extractor örnekleri ve oynatıcı imza önbelleği sıcak kalır.
+    İndirmeler hook/postprocessor taşıdığı için download() ile her işte yeni örnek alır ve
+    bilgi çıkarma sınırına dahil edilmez; indirme eşzamanlılığı iş kuyruğu ile sınırlanır.
+    """
+
+    def __init__(self, size: int, base_opts: dict):
+        self._size = max(1, size)
+        self._base_opts = base_opts
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._idle = {}  # seçenek profili -> boştaki örnekler
+
+    @contextlib.contextmanager
+    def acquire(self, opts: dict = None, block: bool = True, reserve: int = 0):
+        """
+        Verilen profil için boştaki bir örneği (yoksa yenisini) ödünç verir.
+        opts yalnızca sabit bilgi çıkarma seçenekleri içermelidir (hook, postprocessor olmaz).
+        block False ise ve alındıktan sonra en az reserve kadar yer boş kalmayacaksa queue.Empty yükseltilir.
+        """
+        opts = opts or {}
+        key = repr(sorted(opts.items()))
+        with self._cond:
+            if not block and self._in_use + reserve >= self._size:
+                raise queue.Empty()
+            while self._in_use >= self._size:
+                self._cond.wait()
+            self._in_use += 1
+            idle = self._idle.setdefault(key, [])
+            ydl = idle.pop() if idle else None
+        try:
+            if ydl is None:
+                ydl = yt_dlp.YoutubeDL({**self._base_opts, **opts})
+            with cookie_session(ydl):
+                yield ydl
+        finally:
+            with self._cond:
+                # Seçenekler hiç değiştirilmediği için hata alan örnek de tekrar kullanılabilir
+                if ydl is not None:
+                    self._idle[key].append(ydl)
+                self._in_use -= 1
+                self._cond.notify()
+
+    @contextlib.contextmanager
+    def download(self, opts: dict):
+        """İndirme işi için ortak ve işe özel seçeneklerle yeni bir YoutubeDL örneği oluşturur."""
+        with yt_dlp.YoutubeDL({**self._base_opts, **opts}) as ydl:
+            with cookie_session(ydl):
+                yield ydl
+
+# yt-dlp oynatıcı/imza önbelleği yeniden başlatmalar arasında da korunur.
+ydl_pool = YoutubeDLPool(YTDL_POOL_SIZE, {
+    'quiet': True,
+    'no_warnings': True,
+    'logger': logger,
+    'cachedir': YTDL_CACHE_DIR,
+    # Çerezler CookieManager tarafından her işte bellekten yüklenir
+    'cookiefile': None
+})
+
+# Kullanım kayıtları ve kotalar için ortak SQLite veritabanı
+db_lock = threading.Lock()
+db = sqlite3.connect(DB_PATH, check_same_thread=False)
+
+def init_db():
+    with db_lock, db:
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS usage (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                bytes_down INTEGER NOT NULL DEFAULT 0,
+                bytes_up INTEGER NOT NULL DEFAULT 0,
+                jobs INTEGER NOT NULL DEFAULT 0,
+                cpu_seconds REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            );
+            CREATE TABLE IF NOT EXISTS quotas (
+                user_id INTEGER PRIMARY KEY,
+                daily_bytes INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                allowed INTEGER NOT NULL DEFAULT 0,
+                default_quality TEXT,
+                audio_codec TEXT,
+                split_mode TEXT,
+                compatible TEXT
+            );
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        # Eski veritabanlarına sonradan eklenen tercih sütunları
+        columns = {row[1] for row in db.execute("PRAGMA table_info(users)")}
+        if "compatible" not in columns:
+            db.execute("ALTER TABLE users ADD COLUMN compatible TEXT")
+
+init_db()
+
+# /pref ile ayarlanabilen kullanıcı tercihleri ve kabul edilen değerler
+USER_PREFERENCES = {
+    "default_quality": ("1080", "720", "480", "360", "audio"),
+    "audio_codec": ("mp3", "m4a", "opus"),
+    "split_mode": ("equal", "fixed"),
+    "compatible": ("on",),
+}
+
+# /setting ile yeniden başlatmadan değiştirilebilen ayarlar: anahtar -> değer dönüştürücü
+RUNTIME_SETTINGS = {
+    "equal_split": lambda value: value.lower() in ("1", "true", "on", "yes", "evet"),
+    "daily_quota_gb": float,
+}
+
+class UserStore:
+    """
+    Yetkili kullanıcıları, kullanıcı tercihlerini ve çalışma zamanı ayarlarını SQLite'ta tutar.
+    Okumalar bellekteki indeksten yapılır; veritabanı dışarıdan değiştirildiğinde indeks yeniden yüklenir.
+    """
+
+    def __init__(self):
+        self._allowed = frozenset()
+        self._prefs = {}
+        self._settings = {}
+        self._data_version = None
+        self._import_config_users()
+        self.reload()
+
+    def _import_config_users(self):
+        """İlk çalıştırmada config.py'deki ALLOWED_USERS veritabanına aktarılır."""
+        with db_lock, db:
+            imported = db.execute("SELECT 1 FROM settings WHERE key = 'allowed_users_imported'").fetchone()
+            if imported:
+                return
+            db.executemany(
+                "INSERT OR IGNORE INTO users (user_id, allowed) VALUES (?, 1)",
+                [(int(user_id),) for user_id in ALLOWED_USERS]
+            )
+            db.execute("INSERT INTO settings (key, value) VALUES ('allowed_users_imported', '1')")
+
+    def reload(self):
+        with db_lock:
+            self._data_version = db.execute("PRAGMA data_version").fetchone()[0]
+            users = db.execute(
+                "SELECT user_id, allowed, default_quality, audio_codec, split_mode, compatible FROM users"
+            ).fetchall()
+            settings = db.execute("SELECT key, value FROM settings").fetchall()
+        prefs = {}
+        for user_id, _, default_quality, audio_codec, split_mode, compatible in users:
+            prefs[user_id] = {
+                "default_quality": default_quality,
+                "audio_codec": audio_codec,
+                "split_mode": split_mode,
+                "compatible": compatible
+            }
+        # Referanslar tek seferde değiştirildiği için okuyucuların kilide ihtiyacı yok
+        self._allowed = frozenset(user_id for user_id, allowed, *_ in users if allowed)
+        self._prefs = prefs
+        self._settings = dict(settings)
+
+    def watch(self, interval: float = 5):
+        """Veritabanı başka bir bağlantıdan değiştirildiğinde indeksi yeniler."""
+        while True:
+            time.sleep(interval)
+            try:
+                with db_lock:
+                    data_version = db.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self._data_version:
+                    logger.info("Kullanıcı ayarları değişti, yeniden yükleniyor.")
+                    self.reload()
+            except Exception as e:
+                logger.error("Kullanıcı ayarları yeniden yüklenemedi: %s", e)
+
+    def is_allowed(self, user_id: int) -> bool:
+        return user_id in self._allowed
+
+    def set_allowed(self, user_id: int, allowed: bool):
+        with db_lock, db:
+            db.execute(
+                "INSERT INTO users (user_id, allowed) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET allowed = excluded.allowed",
+                (user_id, int(allowed))
+            )
+        self.reload()
+
+    def get_pref(self, user_id: int, key: str):
+        return self._prefs.get(user_id, {}).get(key)
+
+    def set_pref(self, user_id: int, key: str, value):
+        if key not in USER_PREFERENCES:
+            raise ValueError(key)
+        with db_lock, db:
+            db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            db.execute(f"UPDATE users SET {key} = ? WHERE user_id = ?", (value, user_id))
+        self.reload()
+
+    def setting(self, key: str, default):
+        value = self._settings.get(key)
+        if value is None:
+            return default
+        try:
+            return RUNTIME_SETTINGS[key](value)
+        except Exception:
+            return default
+
+    def set_setting(self, key: str, value):
+        with db_lock, db:
+            if value is None:
+                db.execute("DELETE FROM settings WHERE key = ?", (key,))
+            else:
+                db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+        self.reload()
+
+    def equal_split(self, user_id: int) -> bool:
+        split_mode = self.get_pref(user_id, "split_mode")
+        if split_mode:
+            return split_mode == "equal"
+        return self.setting("equal_split", EQUAL_SPLIT)
+
+    def audio_codec(self, user_id: int) -> str:
+        return self.get_pref(user_id, "audio_codec") or "mp3"
+
+    def compatible(self, user_id: int) -> bool:
+        return self.get_pref(user_id, "compatible") == "on"
+
+user_store = UserStore()
+
+class UsageStore:
+    """Kullanıcı başına günlük indirme/yükleme, iş sayısı ve CPU süresi kayıtlarını tutar."""
+
+    @staticmethod
+    def today() -> str:
+        return time.strftime("%Y-%m-%d")
+
+    def add(self, user_id: int, bytes_down: int = 0, bytes_up: int = 0, jobs: int = 0, cpu_seconds: float = 0.0):
+        try:
+            with db_lock, db:
+                db.execute(
+                    """
+                    INSERT INTO usage (user_id, day, bytes_down, bytes_up, jobs, cpu_seconds)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(user_id, day) DO UPDATE SET
+                        bytes_down = bytes_down + excluded.bytes_down,
+                        bytes_up = bytes_up + excluded.bytes_up,
+                        jobs = jobs + excluded.jobs,
+                        cpu_seconds = cpu_seconds + excluded.cpu_seconds
+                    """,
+                    (user_id, self.today(), bytes_down, bytes_up, jobs, cpu_seconds)
+                )
+        except Exception as e:
+            logger.error("Kullanım kaydı güncellenemedi: %s", e)
+
+    def get(self, user_id: int, day: str = None) -> dict:
+        with db_lock:
+            row = db.execute(
+                "SELECT bytes_down, bytes_up, jobs, cpu_seconds FROM usage WHERE user_id = ? AND day = ?",
+                (user_id, day or self.today())
+            ).fetchone()
+        bytes_down, bytes_up, jobs, cpu_seconds = row or (0, 0, 0, 0.0)
+        return {"bytes_down": bytes_down, "bytes_up": bytes_up, "jobs": jobs, "cpu_seconds": cpu_seconds}
+
+    def top(self, day: str = None, limit: int = 10) -> list:
+        with db_lock:
+            return db.execute(
+                "SELECT user_id, bytes_down, bytes_up, jobs, cpu_seconds FROM usage "
+                "WHERE day = ? ORDER BY bytes_down DESC LIMIT ?",
+                (day or self.today(), limit)
+            ).fetchall()
+
+    def get_quota(self, user_id: int) -> int:
+        """Günlük indirme kotasını bayt olarak döndürür, 0 sınırsız demektir."""
+        with db_lock:
+            row = db.execute("SELECT daily_bytes FROM quotas WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            return row[0]
+        return int(user_store.setting("daily_quota_gb", DAILY_QUOTA_GB) * 1024 ** 3)
+
+    def set_quota(self, user_id: int, daily_bytes):
+        """daily_bytes None ise kullanıcı varsayılan kotaya döner."""
+        with db_lock, db:
+            if daily_bytes is None:
+                db.execute("DELETE FROM quotas WHERE user_id = ?", (user_id,))
+            else:
+                db.execute(
+                    "INSERT OR REPLACE INTO quotas (user_id, daily_bytes) VALUES (?, ?)",
+                    (user_id, daily_bytes)
+                )
+
+    def over_quota(self, user_id: int) -> bool:
+        if user_id == OWNER_ID:
+            return False
+        quota = self.get_quota(user_id)
+        return bool(quota) and self.get(user_id)["bytes_down"] >= quota
+
+    def is_heavy(self, user_id: int) -> bool:
+        return self.get(user_id)["bytes_down"] >= HEAVY_USER_GB * 1024 ** 3
+
+usage_store = UsageStore()
+
+class FairScheduler:
+    """
+    Aynı anda çalışan iş sayısını MAX_CONCURRENT_JOBS ile sınırlar.
+    Bekleyen işler arasında o gün en az indirme yapan kullanıcı önce çalışır.
+    """
+
+    def __init__(self, slots: int):
+        self._slots = max(1, slots)
+        self._active = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def has_waiters(self) -> bool:
+        with self._cond:
+            return bool(self._waiting)
+
+    @contextlib.contextmanager
+    def slot(self, user_id: int, on_wait=None, cancel_token=None):
+        entry = (usage_store.get(user_id)["bytes_down"], next(self._seq), user_id)
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            must_wait = self._active >= self._slots or self._waiting[0] is not entry
+        if must_wait and on_wait:
+            on_wait()
+        with self._cond:
+            while self._active >= self._slots or self._waiting[0] is not entry:
+                if cancel_token and cancel_token.cancelled:
+                    # İptal edilen iş sıradan çıkarılır, kalanlar yeniden değerlendirilir
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise JobCancelled()
+                self._cond.wait(timeout=1)
+            heapq.heappop(self._waiting)
+            self._active += 1
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+fair_scheduler = FairScheduler(MAX_CONCURRENT_JOBS)
+
+# track_cpu_usage ile çalışan işin kullanıcısı; iş parçacığında başlatılan alt süreçler bu kullanıcıya işlenir
+cpu_owner = threading.local()
+
+def track_cpu_usage(func):
+    """
+    İlk argümanı user_id olan fonksiyonun iş parçacığında harcadığı CPU süresini kullanıcıya işler.
+    Alt süreçlerin (ffmpeg, curl...) süresi reap_process ile ayrıca işlenir.
+    """
+    @functools.wraps(func)
+    def wrapper(user_id, *args, **kwargs):
+        cpu_start = time.thread_time()
+        previous_owner = getattr(cpu_owner, "user_id", None)
+        cpu_owner.user_id = user_id
+        try:
+            return func(user_id, *args, **kwargs)
+        finally:
+            cpu_owner.user_id = previous_owner
+            usage_store.add(user_id, cpu_seconds=max(0.0, time.thread_time() - cpu_start))
+    return wrapper
+
+def reap_process(process, user_id: int = None) -> int:
+    """
+    Süreci os.wait4 ile bekleyip çıkış kodunu döner; yalnızca bu alt sürecin CPU süresini
+    user_id'ye (verilmezse çağıran işin kullanıcısına) işler. RUSAGE_CHILDREN süreç geneli olduğu için
+    eşzamanlı işlerin süreleri birbirine karışırdı. yt-dlp'nin kendi başlattığı ffmpeg süreçleri sayılmaz.
+    """
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Süreç başka yerde (ör. iptal sırasında poll ile) toplanmış, CPU süresi bilinemez
+        return process.wait()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if user_id is None:
+        user_id = getattr(cpu_owner, "user_id", None)
+    if user_id is not None:
+        usage_store.add(user_id, cpu_seconds=rusage.ru_utime + rusage.ru_stime)
+    return process.returncode
+
 def sanitize_filename(name: str) -> str:
     return re.sub(r'[\\/*?:"<>|]', "", name)
 
@@ -68,11 +708,190 @@ def format_duration(seconds: int) -> str:
     s = seconds % 60
     return f"{h:02d}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
 
-def start_quality_timeout(user_id: int, quality_msg: types.Message):
+# "link 01:02:00-01:05:30" şeklindeki kesit isteklerini yakalar
+CLIP_PATTERN = re.compile(r"^(\S+)\s+(\d+(?::\d{1,2}){0,2})\s*-\s*(\d+(?::\d{1,2}){0,2})$")
+
+def parse_timestamp(value: str) -> int:
+    """
+    "SS", "MM:SS" veya "HH:MM:SS" biçimindeki zamanı saniyeye çevirir.
+    İlk alandan sonraki dakika/saniye alanları 59'u aşarsa ValueError yükseltilir.
+    """
+    parts = [int(part) for part in value.split(":")]
+    if any(part > 59 for part in parts[1:]):
+        raise ValueError(value)
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+def parse_clip_request(text: str):
+    """
+    Metni (link, (başlangıç, bitiş)) olarak ayırır; kesit yoksa ikinci değer None olur.
+    Zamanlar geçersizse ValueError yükseltilir.
+    """
+    m = CLIP_PATTERN.match(text)
+    if not m:
+        return text, None
+    return m.group(1), (parse_timestamp(m.group(2)), parse_timestamp(m.group(3)))
+
+def format_clip(clip) -> str:
+    start, end = clip
+    return f"{format_duration(start)}-{format_duration(end)}"
+
+def trim_to_clip(file_path: str, offset: float, length: float) -> bool:
+    """
+    Dosyayı yeniden kodlamadan (stream copy) keyframe'lerden keserek verilen aralığa indirir.
+    Başarılı olursa dosya yerinde değiştirilir.
+    """
+    root, ext = os.path.splitext(file_path)
+    trimmed_path = f"{root}.trim{ext}"
+    try:
+        run_cancellable(
+            ffmpeg
+            .input(file_path, ss=offset)
+            .output(trimmed_path, t=length, c="copy", avoid_negative_ts="make_zero")
+            .compile(overwrite_output=True)
+        )
+        os.replace(trimmed_path, file_path)
+        logger.info("Dosya kesite göre kırpıldı: %s", file_path)
+        return True
+    except Exception as e:
+        logger.error("Kesit kırpılırken hata: %s", e)
+        if os.path.exists(trimmed_path):
+            os.remove(trimmed_path)
+        return False
+
+# Telegram istemcilerinin tamamında oynatılabilen codec'ler
+COMPATIBLE_VIDEO_CODECS = ("h264",)
+COMPATIBLE_AUDIO_CODECS = ("aac", "mp3")
+
+# CPU yoğun dönüştürmeler indirme/yükleme işçilerinden ayrı, çekirdek sayısına göre sınırlı bir havuzda çalışır
+transcode_executor = concurrent.futures.ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="transcode")
+
+def compatible_format_spec(fmt_spec: str) -> str:
+    """
+    Uyumlu modda önce yeniden kodlama gerektirmeyen (H.264 + AAC) formatları tercih eden format ifadesi döndürür.
+    Uygun format yoksa normal ifadeye geri dönülür.
+    """
+    first = fmt_spec.split("/", 1)[0]
+    preferred = first.replace("+bestaudio", "+bestaudio[acodec^=mp4a]").replace("bestvideo", "bestvideo[vcodec^=avc1]")
+    return f"{preferred}/{fmt_spec}" if preferred != first else fmt_spec
+
+def build_compatible_command(file_path: str, output_path: str):
+    """
+    Dosyanın codec'lerine bakarak H.264/AAC MP4 elde etmek için gereken ffmpeg komutunu döndürür.
+    Uyumlu akışlar kopyalanır; dosya zaten uyumluysa None döner.
+    """
+    probe = ffmpeg.probe(file_path)
+    streams = probe.get("streams", [])
+    video = next((st for st in streams if st.get("codec_type") == "video" and not st.get("disposition", {}).get("attached_pic")), None)
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+    # 10-bit H.264 birçok cihazda oynatılamadığı için yeniden kodlanır
+    video_ok = video is None or (video.get("codec_name") in COMPATIBLE_VIDEO_CODECS and video.get("pix_fmt") in ("yuv420p", "yuvj420p"))
+    audio_ok = audio is None or audio.get("codec_name") in COMPATIBLE_AUDIO_CODECS
+    container_ok = "mp4" in probe.get("format", {}).get("format_name", "")
+    if video_ok and audio_ok and container_ok:
+        return None
+    # Gömülü altyazılar korunur, bölüm bilgileri ffmpeg tarafından varsayılan olarak kopyalanır
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", file_path, "-map", "0:v:0?", "-map", "0:a:0?", "-map", "0:s?"]
+    if video_ok:
+        cmd += ["-c:v", "copy"]
+    else:
+        cmd += [
+            "-c:v", "libx264", "-preset", TRANSCODE_PRESET, "-crf", str(TRANSCODE_CRF),
+            "-pix_fmt", "yuv420p", "-threads", str(TRANSCODE_THREADS)
+        ]
+    cmd += ["-c:a", "copy"] if audio_ok else ["-c:a", "aac", "-b:a", "192k"]
+    cmd += ["-c:s", "mov_text", "-movflags", "+faststart", output_path]
+    if TRANSCODE_NICE and shutil.which("nice"):
+        cmd = ["nice", "-n", str(TRANSCODE_NICE)] + cmd
+    return cmd
+
+def make_compatible(file_path: str, cancel_token: "CancelToken" = None) -> bool:
+    """
+    Dosyayı gerekiyorsa H.264/AAC MP4'e dönüştürür ve yerinde değiştirir.
+    Dönüştürme yapıldıysa True döner. transcode_executor içinde çalıştırılır.
+    """
+    if cancel_token:
+        cancel_token.check()
+    root, _ = os.path.splitext(file_path)
+    output_path = f"{root}.compat.mp4"
+    cmd = build_compatible_command(file_path, output_path)
+    if cmd is None:
+        logger.info("Dosya zaten uyumlu, dönüştürme atlandı: %s", file_path)
+        return False
+    logger.info("Dosya uyumlu formata dönüştürülüyor: %s", file_path)
+    started = time.time()
+    try:
+        run_cancellable(cmd, cancel_token)
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    os.replace(output_path, file_path)
+    logger.info("Dönüştürme %.1f saniyede tamamlandı: %s", time.time() - started, file_path)
+    return True
+
+class Timer:
+    """TimerWheel.schedule tarafından döndürülen, iptal edilebilen zamanlayıcı."""
+    __slots__ = ("rounds", "callback", "args", "cancelled")
+
+    def __init__(self, rounds: int, callback, args):
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class TimerWheel:
+    """
+    Tek bir iş parçacığıyla çalışan hashed timing wheel.
+    Her istek için ayrı uyuyan thread açmak yerine tüm zaman aşımları burada tutulur.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64):
+        self._tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._position = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, delay: float, callback, *args) -> Timer:
+        ticks = max(1, math.ceil(delay / self._tick))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            timer = Timer((ticks - 1) // len(self._slots), callback, args)
+            self._slots[(self._position + ticks) % len(self._slots)].append(timer)
+        return timer
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self._tick
+            time.sleep(max(0, next_tick - time.monotonic()))
+            with self._lock:
+                self._position = (self._position + 1) % len(self._slots)
+                slot = self._slots[self._position]
+                due = [t for t in slot if t.rounds == 0 and not t.cancelled]
+                remaining = [t for t in slot if t.rounds > 0 and not t.cancelled]
+                for t in remaining:
+                    t.rounds -= 1
+                self._slots[self._position] = remaining
+            for t in due:
+                try:
+                    t.callback(*t.args)
+                except Exception as e:
+                    logger.error("Zamanlayıcı çalıştırılırken hata: %s", e)
+
+timer_wheel = TimerWheel()
+
+def expire_quality_menu(user_id: int, user_data: dict, quality_msg: types.Message):
     """60 saniye içinde kalite seçilmezse uyarı verip işlemi iptal eder."""
-    time.sleep(60)
-    user_data = user_video_info.get(user_id)
-    if user_data and not user_data.get("selection_made", False):
+    if user_video_info.get(user_id) is user_data and not user_data.get("selection_made", False):
         try:
             logger.info("Kalite seçilmedi, işlem iptal edildi")
             quality_msg.edit_text("Herhangi bir kalite seçmedin, işlem iptal edildi.", reply_markup=None)
@@ -80,6 +899,310 @@ def start_quality_timeout(user_id: int, quality_msg: types.Message):
             logger.error("Kalite timeout mesajı güncellenirken hata: %s", e)
         user_video_info.pop(user_id, None)
 
+def start_quality_timeout(user_id: int, quality_msg: types.Message):
+    """Kullanıcının güncel kalite menüsü için 60 saniyelik zaman aşımı kurar."""
+    user_data = user_video_info.get(user_id)
+    if user_data is not None:
+        user_data["menu_timer"] = timer_wheel.schedule(60, expire_quality_menu, user_id, user_data, quality_msg)
+
+class JobCancelled(Exception):
+    pass
+
+class CancelToken:
+    """
+    Bir işin iptal durumunu tutar. İptal edildiğinde işe kayıtlı alt süreçler ve
+    işin geçici dizinini kullanan yt-dlp/ffmpeg alt süreçleri sonlandırılır.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id: int):
+        self.job_id = next(CancelToken._ids)
+        self.user_id = user_id
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._paths = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """En fazla timeout saniye bekler; iş iptal edildiyse True döner."""
+        return self._event.wait(timeout)
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+    def register_process(self, process):
+        with self._lock:
+            self._processes.add(process)
+        if self.cancelled:
+            process.kill()
+
+    def unregister_process(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def register_path(self, path: str):
+        """Komut satırında bu yolu içeren alt süreçler iptalde sonlandırılır."""
+        with self._lock:
+            self._paths.add(path)
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            processes = list(self._processes)
+            paths = list(self._paths)
+        for process in processes:
+            try:
+                process.kill()
+            except Exception:
+                pass
+        if paths:
+            kill_child_processes_using(paths)
+
+def kill_child_processes_using(paths: list):
+    """yt-dlp'nin kendi başlattığı ffmpeg süreçlerini, işin geçici dizinine göre bulup sonlandırır."""
+    own_pid = os.getpid()
+    for pid in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if ppid != own_pid:
+                continue
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().decode(errors="ignore")
+            if any(path in cmdline for path in paths):
+                os.kill(int(pid), signal.SIGKILL)
+                logger.info("İptal edilen işin alt süreci sonlandırıldı: %s", pid)
+        except Exception:
+            continue
+
+def run_cancellable(cmd: list, cancel_token: CancelToken = None):
+    """Komutu çalıştırır; iş iptal edilirse süreç sonlandırılır ve JobCancelled yükseltilir."""
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if cancel_token:
+        cancel_token.register_process(process)
+    try:
+        # Yalnızca stderr yakalandığı için sonuna kadar okumak kilitlenmeye yol açmaz
+        stderr = process.stderr.read()
+        reap_process(process, cancel_token.user_id if cancel_token else None)
+    finally:
+        process.stderr.close()
+        if cancel_token:
+            cancel_token.unregister_process(process)
+    if cancel_token:
+        cancel_token.check()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+# Kullanımdaki çalışma dizinleri ve bekleme süresi dolunca silinecek dizinlerin zamanlayıcıları
+work_dirs_lock = threading.Lock()
+work_dirs_in_use = set()
+work_dir_timers = {}
+
+def remove_work_dir(path: str):
+    with work_dirs_lock:
+        if path in work_dirs_in_use:
+            return
+        work_dir_timers.pop(path, None)
+    shutil.rmtree(path, ignore_errors=True)
+    logger.info("Çalışma dizini silindi: %s", path)
+
+@contextlib.contextmanager
+def job_work_dir(key: str):
+    """
+    İş için WORK_DIR altında, aynı iş tekrar denendiğinde yine aynı olan bir çalışma dizini açar.
+    Böylece yarım kalan yt-dlp .part dosyaları ve ayrılmış parçalar sonraki denemede kullanılır.
+    Başarılı ya da iptal edilen işlerde dizin hemen, başarısız işlerde RETRY_GRACE_SECONDS sonra silinir.
+    Anahtar hedef sohbeti de içermelidir; gönderilmiş parçaların kaydı dizinde tutulur.
+    """
+    path = os.path.join(WORK_DIR, hashlib.sha1(key.encode()).hexdigest()[:16])
+    resumable = True
+    with work_dirs_lock:
+        if path in work_dirs_in_use:
+            # Aynı iş zaten çalışıyor; geçici dizinden sonra devam edilemeyeceği için saklanmaz
+            os.makedirs(WORK_DIR, exist_ok=True)
+            path = tempfile.mkdtemp(dir=WORK_DIR)
+            resumable = False
+        work_dirs_in_use.add(path)
+        timer = work_dir_timers.pop(path, None)
+        if timer:
+            timer.cancel()
+    os.makedirs(path, exist_ok=True)
+    work = {"path": path, "keep": resumable}
+    try:
+        yield work
+    except JobCancelled:
+        work["keep"] = False
+        raise
+    finally:
+        with work_dirs_lock:
+            work_dirs_in_use.discard(path)
+            if work["keep"]:
+                work_dir_timers[path] = timer_wheel.schedule(RETRY_GRACE_SECONDS, remove_work_dir, path)
+        if not work["keep"]:
+            shutil.rmtree(path, ignore_errors=True)
+
+def cleanup_stale_work_dirs():
+    """Önceki çalışmadan kalan ve bekleme süresi dolmuş çalışma dizinlerini siler."""
+    if not os.path.isdir(WORK_DIR):
+        return
+    for name in os.listdir(WORK_DIR):
+        path = os.path.join(WORK_DIR, name)
+        try:
+            # Arka planda çalıştığı için bu arada yeniden açılmış dizinlere dokunulmaz
+            with work_dirs_lock:
+                if path in work_dirs_in_use or path in work_dir_timers:
+                    continue
+                if time.time() - os.path.getmtime(path) <= RETRY_GRACE_SECONDS:
+                    work_dir_timers[path] = timer_wheel.schedule(RETRY_GRACE_SECONDS, remove_work_dir, path)
+                    continue
+            shutil.rmtree(path, ignore_errors=True)
+        except Exception as e:
+            logger.error("Eski çalışma dizini silinemedi: %s", e)
+
+# Çalışan ve sırada bekleyen işler: job_id -> CancelToken
+active_jobs = {}
+
+def cancel_markup(cancel_token: CancelToken = None):
+    if cancel_token is None:
+        return None
+    return types.InlineKeyboardMarkup(
+        [[types.InlineKeyboardButton(text="İptal", callback_data=f"cancel|{cancel_token.job_id}")]]
+    )
+
+# Başarısız olan ve tekrar denenebilecek işler: job_id -> iş bilgileri
+retry_jobs = {}
+
+def remember_failed_job(job_id: int, job: dict, status_msg: types.Message):
+    """
+    Başarısız işi RETRY_GRACE_SECONDS boyunca saklar ve mesaja "Tekrar dene" düğmesi ekler.
+    Çalışma dizini de aynı süre korunduğu için tekrar deneme kaldığı yerden devam eder.
+    """
+    retry_jobs[job_id] = job
+    timer_wheel.schedule(RETRY_GRACE_SECONDS, retry_jobs.pop, job_id, None)
+    try:
+        status_msg.edit_reply_markup(types.InlineKeyboardMarkup(
+            [[types.InlineKeyboardButton(text="Tekrar dene", callback_data=f"retry|{job_id}")]]
+        ))
+    except Exception as e:
+        logger.error("Tekrar deneme düğmesi eklenemedi: %s", e)
+
+def format_speed(rate: float) -> str:
+    return f"{rate / (1024 * 1024):.2f} MB/s"
+
+class ProgressTracker:
+    """
+    Bir işin indirme, işleme ve yükleme aşamalarını ağırlıklarıyla tek bir toplam ilerlemede birleştirir
+    ve durum mesajını PROGRESS_UPDATE_INTERVAL aralıklarla günceller. Hız EWMA ile yumuşatılır,
+    kalan süre bu hızdan hesaplanır. update() yüklemede her parça için çağrıldığından, bir sonraki
+    bayt eşiğine ulaşılmadıkça saat okunmaz ve metin oluşturulmaz.
+    """
+
+    EWMA_ALPHA = 0.3
+    SAMPLE_INTERVAL = 1.0
+
+    def __init__(self, status_msg, cancel_token=None, stages=None, unit_bytes: bool = True):
+        # stages: anahtar -> (etiket, ağırlık), sırası aşamaların sırasıdır
+        stages = stages or {"download": ("İndiriliyor", 1)}
+        total_weight = sum(weight for _, weight in stages.values())
+        self._stages = {}
+        base = 0.0
+        for key, (label, weight) in stages.items():
+            self._stages[key] = (label, base, weight / total_weight)
+            base += weight / total_weight
+        self.status_msg = status_msg
+        self.cancel_token = cancel_token
+        self.unit_bytes = unit_bytes
+        self._overall = 0.0
+        self._last_emit = 0.0
+        self._last_text = None
+        self.start_stage(next(iter(self._stages)), emit=False)
+
+    def start_stage(self, key: str, total: int = 0, label: str = None, emit: bool = True):
+        """Yeni aşamaya geçer; total biliniyorsa aşamanın toplam boyutudur."""
+        if key not in self._stages:
+            return
+        stage_label, self._base, self._weight = self._stages[key]
+        self.stage = key
+        self._label = label or stage_label
+        self._total = total
+        self._total_known = bool(total)
+        self._offset = 0
+        self._done = 0
+        self._next_check = 0
+        self._step = 0
+        self._rate = None
+        self._sample_time = time.monotonic()
+        self._sample_done = 0
+        if emit:
+            self._emit(self._sample_time)
+
+    def set_total(self, total: int):
+        if total:
+            self._total = total
+            self._total_known = True
+
+    def begin_part(self, offset: int, label: str = None):
+        """Aşamanın yeni bir parçasına geçer; hız ölçümü korunur."""
+        self._offset = offset
+        if label:
+            self._label = label
+        self._next_check = 0
+
+    def finish_part(self, size: int):
+        self.begin_part(self._offset + (size or 0))
+
+    def update(self, done: int, total: int = None):
+        """Geçerli parçada done birim tamamlandı; total verilmişse parçanın toplamıdır."""
+        done += self._offset
+        self._done = done
+        if total and not self._total_known:
+            self._total = self._offset + total
+        if done < self._next_check:
+            return
+        now = time.monotonic()
+        elapsed = now - self._sample_time
+        if elapsed >= self.SAMPLE_INTERVAL:
+            rate = max(0.0, (done - self._sample_done) / elapsed)
+            self._rate = rate if self._rate is None else self.EWMA_ALPHA * rate + (1 - self.EWMA_ALPHA) * self._rate
+            self._sample_time = now
+            self._sample_done = done
+            # Saat yaklaşık saniyede dört kez okunur
+            self._step = int(self._rate / 4)
+        self._next_check = done + self._step
+        if now - self._last_emit >= PROGRESS_UPDATE_INTERVAL:
+            self._emit(now)
+
+    def _emit(self, now: float):
+        self._last_emit = now
+        if self._total:
+            fraction = min(1.0, self._done / self._total)
+            text = f"{self._label}: {fraction * 100:.2f}%"
+            if self._rate:
+                if self.unit_bytes:
+                    text += f" ({format_speed(self._rate)})"
+                text += f" - Kalan süre: {int(max(0, self._total - self._done) / self._rate)} sn"
+        else:
+            fraction = 0.0
+            text = f"{self._label}..."
+        self._overall = max(self._overall, self._base + self._weight * fraction)
+        if len(self._stages) > 1:
+            text += f"\nToplam: {self._overall * 100:.0f}%"
+        if text == self._last_text:
+            return
+        self._last_text = text
+        try:
+            logger.info(text.replace("\n", " - "))
+            self.status_msg.edit_text(text, reply_markup=cancel_markup(self.cancel_token))
+        except Exception as e:
+            logger.error("İlerleme mesajı güncellenemedi: %s", e)
+
 def search_youtube(query: str, max_results: int = 20):
     """
     Youtube Data API v3 kullanarak arama yapar.
@@ -150,11 +1273,130 @@ def check_disk_space(required_space: int) -> bool:
     free_space = statvfs.f_frsize * statvfs.f_bavail
     return free_space >= required_space * 2
 
-def prepare_video_info_and_show_quality(chat_id: int, user_id: int, video_url: str, status_msg: types.Message = None):
+# fetch_video_info ve ön ısıtmanın paylaştığı havuz profili
+VIDEO_INFO_OPTS = {'skip_download': True}
+
+def fetch_video_info(video_url: str, block: bool = True, reserve: int = 0) -> dict:
+    """
+    yt-dlp ile videonun indirme yapmadan bilgilerini (formatlar, altyazılar, bölümler) alır.
+    block ve reserve YoutubeDLPool.acquire'a aktarılır.
+    """
+    with ydl_pool.acquire(VIDEO_INFO_OPTS, block=block, reserve=reserve) as ydl:
+        return ydl.extract_info(video_url, download=False)
+
+def lower_thread_priority():
+    """Linux'ta niceness iş parçacığı başınadır; ön getirme işçileri indirme/yükleme işlerinin gerisinde kalır."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except Exception as e:
+        logger.error("Ön getirme iş parçacığı önceliği düşürülemedi: %s", e)
+
+class MetadataPrefetcher:
+    """
+    Arama sonuçlarının ilk PREFETCH_RESULTS tanesinin bilgilerini, kullanıcı seçim yapmadan önce
+    düşük öncelikli işçilerle alıp sınırlı boyutlu ve süreli bir önbellekte tutar.
+    Ön getirme havuzda en az bir yer gerçek istekler için boş kalacaksa başlar, yoksa atlanır.
+    Aynı anda birden fazla gerçek istek gelirse biri yine de çalışan bir ön getirmenin bitmesini bekleyebilir.
+    """
+
+    def __init__(self, workers: int, size: int, ttl: float):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="prefetch", initializer=lower_thread_priority
+        )
+        self._size = size
+        self._ttl = ttl
+        self._cache = collections.OrderedDict()  # url -> (zaman, info)
+        self._inflight = {}  # url -> Future
+        self._batches = {}  # user_id -> (Future listesi, Timer)
+        self._lock = threading.Lock()
+
+    def _cached(self, url: str):
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self._ttl:
+                del self._cache[url]
+                return None
+            self._cache.move_to_end(url)
+            return entry[1]
+
+    def _store(self, url: str, info: dict):
+        with self._lock:
+            self._cache[url] = (time.monotonic(), info)
+            self._cache.move_to_end(url)
+            while len(self._cache) > self._size:
+                self._cache.popitem(last=False)
+
+    def _fetch(self, url: str):
+        try:
+            info = fetch_video_info(url, block=False, reserve=1)
+        except queue.Empty:
+            logger.info("Havuz meşgul, ön getirme atlandı: %s", url)
+            return None
+        self._store(url, info)
+        return info
+
+    def prefetch(self, user_id: int, urls: list, expires: float = 60):
+        """Kullanıcının önceki ön getirmesini iptal eder ve verilen linkleri sıraya alır."""
+        self.cancel(user_id)
+        submitted = []
+        with self._lock:
+            for url in urls:
+                if url in self._cache or url in self._inflight:
+                    continue
+                future = self._executor.submit(self._fetch, url)
+                self._inflight[url] = future
+                submitted.append((url, future))
+            timer = timer_wheel.schedule(expires, self.cancel, user_id)
+            self._batches[user_id] = ([future for _, future in submitted], timer)
+        # Bitmiş bir future'a eklenen callback hemen bu iş parçacığında çalışır ve _done aynı kilidi
+        # alır; kilit bırakılmadan eklenirse iş parçacığı kendini kilitlerdi
+        for url, future in submitted:
+            future.add_done_callback(lambda f, url=url: self._done(url, f))
+
+    def _done(self, url: str, future):
+        with self._lock:
+            if self._inflight.get(url) is future:
+                del self._inflight[url]
+        if not future.cancelled() and future.exception():
+            logger.info("Ön getirme başarısız (%s): %s", url, future.exception())
+
+    def cancel(self, user_id: int):
+        """Kullanıcının henüz başlamamış ön getirmelerini iptal eder."""
+        with self._lock:
+            futures, timer = self._batches.pop(user_id, ([], None))
+        if timer:
+            timer.cancel()
+        for future in futures:
+            future.cancel()
+
+    def get(self, url: str) -> dict:
+        """Bilgiyi önbellekten ya da devam eden ön getirmeden alır; yoksa hemen kendisi getirir."""
+        info = self._cached(url)
+        if info is not None:
+            logger.info("Video bilgileri ön getirmeden alındı: %s", url)
+            return info
+        with self._lock:
+            future = self._inflight.get(url)
+        if future is not None and not future.cancel():
+            # Ön getirme çalışıyor, aynı isteği ikinci kez yapmak yerine sonucu beklenir
+            try:
+                info = future.result()
+            except Exception:
+                info = None
+            if info is not None:
+                return info
+        return fetch_video_info(url)
+
+prefetcher = MetadataPrefetcher(PREFETCH_WORKERS, PREFETCH_CACHE_SIZE, PREFETCH_TTL)
+
+def prepare_video_info_and_show_quality(chat_id: int, user_id: int, video_url: str, status_msg: types.Message = None, clip=None):
     """
     Verilen video_url için yt-dlp ile video bilgilerini alır,
     user_video_info'yu günceller ve kalite seçeneklerini inline butonlarla kullanıcıya sunar.
     Eğer status_msg parametresi verilmişse, o mesaj üzerinden düzenleme yapılır.
+    clip verilmişse (başlangıç, bitiş) saniye aralığı indirilecek kesit olarak saklanır.
     """
 
     user_video_info[user_id] = {
@@ -164,22 +1406,35 @@ def prepare_video_info_and_show_quality(chat_id: int, user_id: int, video_url: s
         "duration": 0,
         "thumbnail": None,
         "selection_made": False,
-        "bestaudio_info": None
+        "bestaudio_info": None,
+        "clip": clip,
+        "compatible": user_store.compatible(user_id),
+        "subtitle_langs": [],
+        "embed_subs": False,
+        "chapters": [],
+        "chapter_mode": "off"
     }
 
-    ydl_opts = {
-        'skip_download': True,
-        'quiet': True,
-        'no_warnings': True,
-        'logger': logger,
-        'cookiefile': 'cookies.txt' if os.path.exists("cookies.txt") else None
-    }
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=False)
-            user_video_info[user_id]["title"] = info.get("title", "Video")
-            user_video_info[user_id]["duration"] = info.get("duration", 0)
-            user_video_info[user_id]["thumbnail"] = info.get("thumbnail")
+        info = prefetcher.get(video_url)
+        user_video_info[user_id]["title"] = info.get("title", "Video")
+        user_video_info[user_id]["duration"] = info.get("duration", 0)
+        user_video_info[user_id]["thumbnail"] = info.get("thumbnail")
+        # Altyazı ve bölüm bilgileri zaten alınmış bilgiden okunur, ek istek yapılmaz
+        user_video_info[user_id]["subtitle_langs"] = [
+            lang for lang in (info.get("subtitles") or {})
+            if lang.split("-")[0] in SUBTITLE_LANGS
+        ]
+        if not clip:
+            user_video_info[user_id]["chapters"] = [
+                (chapter["start_time"], chapter["end_time"], chapter.get("title") or "")
+                for chapter in info.get("chapters") or []
+                if chapter.get("end_time", 0) > chapter.get("start_time", 0)
+            ]
+        # Video süresini aşan kesit sonu videonun sonuna çekilir
+        if clip and info.get("duration") and clip[1] > info["duration"]:
+            clip = (clip[0], int(info["duration"]))
+            user_video_info[user_id]["clip"] = clip
     except Exception as e:
         logger.error("Video/Ses bilgileri alınırken hata: %s", e)
         if status_msg:
@@ -191,6 +1446,19 @@ def prepare_video_info_and_show_quality(chat_id: int, user_id: int, video_url: s
             app.send_message(chat_id, "Bilgiler alınırken hata oluştu.")
         return
 
+    if clip and clip[0] >= clip[1]:
+        # Kesit videonun bitişinden sonra başlıyor
+        user_video_info.pop(user_id, None)
+        text = f"Geçersiz kesit: başlangıç zamanı video süresini ({format_duration(int(info['duration']))}) aşıyor."
+        if status_msg:
+            try:
+                status_msg.edit_text(text)
+            except Exception as e:
+                logger.error("Mesaj güncelleme hatası: %s", e)
+        else:
+            app.send_message(chat_id, text)
+        return
+
     formats = info.get('formats', [])
     video_options = []
     for f in formats:
@@ -257,21 +1525,242 @@ def prepare_video_info_and_show_quality(chat_id: int, user_id: int, video_url: s
         return
 
     buttons.append([types.InlineKeyboardButton(text=audio_button_text, callback_data="audio|bestaudio")])
+    buttons.extend(menu_option_buttons(user_video_info[user_id]))
     keyboard = types.InlineKeyboardMarkup(buttons)
 
+    prompt = "Lütfen indirmek istediğiniz kaliteyi seçin:"
+    if clip:
+        prompt = f"Kesit: {format_clip(clip)}\n" + prompt
     if status_msg:
         try:
-            status_msg.edit_text("Lütfen indirmek istediğiniz kaliteyi seçin:", reply_markup=keyboard)
+            status_msg.edit_text(prompt, reply_markup=keyboard)
         except Exception as e:
             logger.error("Kalite seçim mesajı güncellenirken hata: %s", e)
     else:
-        app.send_message(chat_id, "Lütfen indirmek istediğiniz kaliteyi seçin:", reply_markup=keyboard)
+        app.send_message(chat_id, prompt, reply_markup=keyboard)
     if status_msg:
-        threading.Thread(target=start_quality_timeout, args=(user_id, status_msg), daemon=True).start()
+        start_quality_timeout(user_id, status_msg)
+
+# Bölüm seçeneği: kapalı, bölüm bilgilerini dosyaya göm, ya da her bölümü ayrı dosya olarak gönder
+CHAPTER_MODES = {"off": "Kapalı", "embed": "Göm", "split": "Ayrı dosyalar"}
+
+def menu_option_buttons(user_data: dict) -> list:
+    """Kalite menüsünün altındaki, seçime kadar değiştirilebilen seçenek düğmeleri."""
+    rows = [[types.InlineKeyboardButton(
+        text=f"Uyumlu mod (H.264/AAC): {'Açık' if user_data.get('compatible') else 'Kapalı'}",
+        callback_data="option|compat"
+    )]]
+    if user_data.get("subtitle_langs"):
+        rows.append([types.InlineKeyboardButton(
+            text=f"Altyazı ({', '.join(user_data['subtitle_langs'])}): {'Açık' if user_data.get('embed_subs') else 'Kapalı'}",
+            callback_data="option|subs"
+        )])
+    if user_data.get("chapters"):
+        rows.append([types.InlineKeyboardButton(
+            text=f"Bölümler ({len(user_data['chapters'])}): {CHAPTER_MODES[user_data.get('chapter_mode', 'off')]}",
+            callback_data="option|chapters"
+        )])
+    return rows
+
+# Oynatma listeleri için toplu kalite profilleri: profil -> buton metni
+PLAYLIST_PROFILES = {
+    "1080": "Video: 1080p",
+    "720": "Video: 720p",
+    "480": "Video: 480p",
+    "360": "Video: 360p",
+    "audio": "Müzik: en iyi (ext: mp3)",
+}
+
+def playlist_link_kind(url: str) -> str:
+    """
+    Linkin türünü döndürür: "playlist" (oynatma listesi/kanal sayfası), "video" ya da
+    "ambiguous" (listeden paylaşılmış tekil video; kullanıcıya sorulur).
+    Mix/radyo listeleri (list=RD...) sonsuz olduğu için her zaman tekil video sayılır.
+    """
+    if re.search(r"youtube\.com/(channel/|c/|user/|@)", url):
+        return "playlist"
+    parsed = urllib.parse.urlparse(url)
+    query = urllib.parse.parse_qs(parsed.query)
+    playlist_id = (query.get("list") or [""])[0]
+    if not playlist_id:
+        return "video"
+    if parsed.path.rstrip("/").endswith("/playlist"):
+        return "playlist"
+    has_video = "v" in query or parsed.netloc.endswith("youtu.be")
+    if not has_video:
+        return "playlist"
+    if playlist_id.startswith("RD"):
+        return "video"
+    return "ambiguous"
+
+def strip_playlist_params(url: str) -> str:
+    """Tekil video olarak indirilecek linkten liste parametrelerini çıkarır, yt-dlp listeyi açmaz."""
+    parsed = urllib.parse.urlparse(url)
+    query = [
+        (key, value) for key, value in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+        if key not in ("list", "index", "start_radio", "pp")
+    ]
+    return urllib.parse.urlunparse(parsed._replace(query=urllib.parse.urlencode(query)))
+
+def profile_format_spec(profile: str) -> str:
+    """Toplu indirme profili için yt-dlp format ifadesini döndürür."""
+    height = int(profile)
+    av1_allowed = AV1_FOR_LOWRES if height <= 480 else AV1_FOR_HIGHRES
+    video_filter = f"[height<={height}]" + ("" if av1_allowed else "[vcodec!^=av01]")
+    return f"bestvideo{video_filter}+bestaudio/best{video_filter}"
+
+def audio_postprocessors(codec: str) -> list:
+    return [{
+        "key": "FFmpegExtractAudio",
+        "preferredcodec": codec,
+        "preferredquality": "0"  # Orijinal kaliteyi korur
+    }]
+
+def build_profile_job(profile: str, title: str, audio_codec: str = "mp3"):
+    """
+    Profil tabanlı (menüsüz) indirmeler için
+    (download_type, fmt_spec, postprocessors, download_file_name, caption_file_name, resolution) döndürür.
+    """
+    if profile == "audio":
+        return "audio", "bestaudio", audio_postprocessors(audio_codec), title, f"{title}.{audio_codec}", "en iyi"
+    return "video", profile_format_spec(profile), [], f"{title}.mp4", f"{title}.mp4", f"{profile}p"
+
+def _iter_playlist_entries(ydl, info: dict, depth: int = 0):
+    """
+    Flat extraction sonucundaki girdileri tembel şekilde dolaşır.
+    Kanal sayfalarındaki sekmeler (Videolar, Shorts...) bir seviye açılır.
+    """
+    for entry in info.get("entries") or []:
+        if not entry:
+            continue
+        if entry.get("_type") == "playlist" and depth < 1:
+            yield from _iter_playlist_entries(ydl, entry, depth + 1)
+        elif entry.get("ie_key") == "YoutubeTab" and depth < 1:
+            try:
+                tab = ydl.extract_info(entry["url"], download=False, process=False)
+            except Exception as e:
+                logger.error("Oynatma listesi sekmesi okunamadı: %s", e)
+                continue
+            yield from _iter_playlist_entries(ydl, tab, depth + 1)
+        else:
+            yield entry
+
+def prepare_playlist_and_show_profiles(chat_id: int, user_id: int, playlist_url: str, status_msg: types.Message, profile: str = None):
+    """
+    Oynatma listesindeki girdileri flat extraction ile (video bilgileri çözülmeden) listeler
+    ve toplu indirme için tek bir kalite profili seçtirir.
+    profile verilmişse (kullanıcı tercihi) menü gösterilmeden işlem başlatılır.
+    """
+    ydl_opts = {
+        'skip_download': True,
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True
+    }
+    entries = []
+    try:
+        with ydl_pool.acquire(ydl_opts) as ydl:
+            info = ydl.extract_info(playlist_url, download=False, process=False)
+            for entry in itertools.islice(_iter_playlist_entries(ydl, info), PLAYLIST_MAX_ENTRIES):
+                video_id = entry.get("id")
+                url = entry.get("url") or entry.get("webpage_url")
+                if url and not re.match(r'https?://', url) and video_id:
+                    url = f"https://www.youtube.com/watch?v={video_id}"
+                if not url:
+                    continue
+                thumbnails = entry.get("thumbnails") or []
+                entries.append({
+                    "id": video_id or url,
+                    "url": url,
+                    "title": entry.get("title") or video_id or "Video",
+                    "duration": entry.get("duration") or 0,
+                    "thumbnail": thumbnails[-1].get("url") if thumbnails else None
+                })
+    except Exception as e:
+        logger.error("Oynatma listesi bilgileri alınırken hata: %s", e)
+        try:
+            status_msg.edit_text("Oynatma listesi bilgileri alınırken hata oluştu.")
+        except Exception:
+            pass
+        return
+
+    if not entries:
+        try:
+            status_msg.edit_text("Oynatma listesinde indirilebilir video bulunamadı.")
+        except Exception as e:
+            logger.error("Mesaj güncelleme hatası: %s", e)
+        return
+
+    user_video_info[user_id] = {
+        "url": playlist_url,
+        "title": info.get("title") or "Oynatma listesi",
+        "entries": entries,
+        "selection_made": False
+    }
+
+    if profile in PLAYLIST_PROFILES:
+        enqueue_or_start(user_id, chat_id, "playlist", profile, status_msg)
+        return
+
+    buttons = [
+        [types.InlineKeyboardButton(text=text, callback_data=f"playlist|{key}")]
+        for key, text in PLAYLIST_PROFILES.items()
+    ]
+    keyboard = types.InlineKeyboardMarkup(buttons)
+    try:
+        status_msg.edit_text(
+            f"{user_video_info[user_id]['title']} ({len(entries)} video)\n"
+            "Tüm liste için indirmek istediğiniz kaliteyi seçin:",
+            reply_markup=keyboard
+        )
+    except Exception as e:
+        logger.error("Kalite seçim mesajı güncellenirken hata: %s", e)
+    start_quality_timeout(user_id, status_msg)
+
+# Daha önce yüklenmiş girdiler: "video_id|profil" -> LOG_CHANNEL mesaj id'leri
+upload_cache_lock = threading.Lock()
+
+def load_upload_cache() -> dict:
+    try:
+        with open(UPLOAD_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error("Yükleme önbelleği okunamadı: %s", e)
+        return {}
+
+upload_cache = load_upload_cache()
+
+def save_upload_cache(key: str, message_ids: list):
+    with upload_cache_lock:
+        upload_cache[key] = message_ids
+        try:
+            tmp_path = UPLOAD_CACHE_FILE + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(upload_cache, f)
+            os.replace(tmp_path, UPLOAD_CACHE_FILE)
+        except Exception as e:
+            logger.error("Yükleme önbelleği kaydedilemedi: %s", e)
+
+def send_from_upload_cache(key: str, chat_id: int) -> bool:
+    """Önbellekteki dosyaları LOG_CHANNEL'dan kopyalar; başarısız olursa kaydı siler."""
+    with upload_cache_lock:
+        message_ids = upload_cache.get(key)
+    if not message_ids:
+        return False
+    try:
+        for message_id in message_ids:
+            app.copy_message(chat_id, LOG_CHANNEL_ID, message_id)
+        return True
+    except Exception as e:
+        logger.error("Önbellekteki dosya gönderilemedi, yeniden indirilecek: %s", e)
+        with upload_cache_lock:
+            upload_cache.pop(key, None)
+        return False
 
 @app.on_message(filters.command("start") & filters.private)
 def start(client, message):
-    if message.from_user.id not in ALLOWED_USERS:
+    if not user_store.is_allowed(message.from_user.id):
         message.reply_text("Üzgünüm, bu botu kullanmaya yetkiniz yok.")
         return
     message.reply_text("Merhaba! Lütfen indirmek istediğiniz video/ses linkini veya arama sorgusunu gönderiniz.")
@@ -284,11 +1773,9 @@ def restart_bot(client, message):
         return
 
     message.reply_text("Bot yeniden başlatılıyor...")
-    # Kısa bir süre uyutup, ardından botu yeniden başlatıyoruz.
+    # reply_text mesaj gönderildikten sonra döndüğü için beklemeden yeniden başlatıyoruz.
     # os.execv() mevcut process'i tamamen yeni process ile değiştirir.
     try:
-        # Öncelikle mesajın gönderilmesi için kısa bir gecikme ekleyelim.
-        time.sleep(2)
         os.execv(sys.executable, [sys.executable] + sys.argv)
     except Exception as e:
         logger.error("Bot yeniden başlatılırken hata oluştu: %s", e)
@@ -302,23 +1789,13 @@ def get_free_space_gb() -> float:
 
 @app.on_message(filters.command("free") & filters.private)
 def free_space(client, message):
-    if message.from_user.id not in ALLOWED_USERS:
+    if not user_store.is_allowed(message.from_user.id):
         message.reply_text("Üzgünüm, bu botu kullanmaya yetkiniz yok.")
         return
 
     free_space_gb = get_free_space_gb()
     message.reply_text(f"Diskte {free_space_gb:.2f} GB boş alan var.")
 
-def save_allowed_users():
-    with open("config.py", "r") as f:
-        lines = f.readlines()
-    with open("config.py", "w") as f:
-        for line in lines:
-            if line.startswith("ALLOWED_USERS"):
-                f.write(f"ALLOWED_USERS = {json.dumps(list(ALLOWED_USERS))}\n")
-            else:
-                f.write(line)
-
 @app.on_message(filters.command("sudo") & filters.private)
 def sudo_user(client, message):
     if message.from_user.id != OWNER_ID:
@@ -327,11 +1804,10 @@ def sudo_user(client, message):
 
     try:
         user_id = int(message.command[1])
-        if user_id in ALLOWED_USERS:
+        if user_store.is_allowed(user_id):
             message.reply_text("Bu kullanıcı zaten yetkili.")
         else:
-            ALLOWED_USERS.add(user_id)
-            save_allowed_users()
+            user_store.set_allowed(user_id, True)
             message.reply_text(f"Kullanıcı {user_id} yetkilendirildi.")
             logger.info(f"Kullanıcı {user_id} yetkilendirildi.")
     except (IndexError, ValueError):
@@ -345,52 +1821,157 @@ def unsudo_user(client, message):
 
     try:
         user_id = int(message.command[1])
-        if user_id not in ALLOWED_USERS:
+        if not user_store.is_allowed(user_id):
             message.reply_text("Bu kullanıcı zaten yetkili değil.")
         else:
-            ALLOWED_USERS.remove(user_id)
-            save_allowed_users()
+            user_store.set_allowed(user_id, False)
             message.reply_text(f"Kullanıcı {user_id} yetkisi kaldırıldı.")
             logger.info(f"Kullanıcı {user_id} yetkisi kaldırıldı.")
     except (IndexError, ValueError):
         message.reply_text("Geçerli bir kullanıcı ID'si girin.")
 
-def download_direct_link(url: str, output_path: str, status_msg: types.Message):
-    try:
-        cmd = ["curl", "--progress-bar", "--no-buffer", "-L", "-o", output_path, url]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        start_time = time.time()
-        last_progress_update = time.time()
-        pattern = re.compile(r'(\d+(?:\.\d+)?)%')
-        eta_pattern = re.compile(r'eta\s+(\d+)\s*s', re.IGNORECASE)
+def format_usage(user_id: int, usage: dict) -> str:
+    quota = usage_store.get_quota(user_id)
+    quota_str = f"{quota / 1024 ** 3:.2f} GB" if quota else "sınırsız"
+    return (
+        f"Kullanıcı {user_id}: İndirilen {usage['bytes_down'] / 1024 ** 3:.2f} GB, "
+        f"Yüklenen {usage['bytes_up'] / 1024 ** 3:.2f} GB, İş: {usage['jobs']}, "
+        f"CPU: {usage['cpu_seconds']:.0f} sn, Kota: {quota_str}"
+    )
+
+@app.on_message(filters.command("usage") & filters.private)
+def usage_command(client, message):
+    if message.from_user.id != OWNER_ID:
+        message.reply_text("Bu komutu kullanmaya yetkiniz yok.")
+        return
 
-        while process.poll() is None:
-            line = process.stderr.readline().strip()
-            if not line:
-                continue
+    if len(message.command) > 1:
+        try:
+            user_id = int(message.command[1])
+        except ValueError:
+            message.reply_text("Geçerli bir kullanıcı ID'si girin.")
+            return
+        message.reply_text(format_usage(user_id, usage_store.get(user_id)))
+        return
+
+    rows = usage_store.top()
+    if not rows:
+        message.reply_text("Bugün henüz kullanım kaydı yok.")
+        return
+    lines = [f"Bugünkü kullanım ({usage_store.today()}):"]
+    for user_id, bytes_down, bytes_up, jobs, cpu_seconds in rows:
+        usage = {"bytes_down": bytes_down, "bytes_up": bytes_up, "jobs": jobs, "cpu_seconds": cpu_seconds}
+        lines.append(format_usage(user_id, usage))
+    message.reply_text("\n".join(lines))
+
+@app.on_message(filters.command("quota") & filters.private)
+def quota_command(client, message):
+    if message.from_user.id != OWNER_ID:
+        message.reply_text("Bu komutu kullanmaya yetkiniz yok.")
+        return
+
+    try:
+        user_id = int(message.command[1])
+        value = message.command[2].lower()
+        if value == "default":
+            usage_store.set_quota(user_id, None)
+        else:
+            usage_store.set_quota(user_id, int(float(value) * 1024 ** 3))
+    except (IndexError, ValueError):
+        message.reply_text("Kullanım: /quota <kullanıcı_id> <GB | 0 (sınırsız) | default>")
+        return
+    message.reply_text(format_usage(user_id, usage_store.get(user_id)))
+    logger.info(f"Kullanıcı {user_id} kotası güncellendi: {value}")
+
+@app.on_message(filters.command("cookies") & filters.private)
+def cookies_command(client, message):
+    if message.from_user.id != OWNER_ID:
+        message.reply_text("Bu komutu kullanmaya yetkiniz yok.")
+        return
+
+    # /cookies reload: çerezler beklemeden yeniden indirilir/okunur
+    if len(message.command) > 1 and message.command[1].lower() == "reload":
+        cookie_manager.request_refresh()
+        message.reply_text("Çerezler yenileniyor...")
+        return
+    message.reply_text(cookie_manager.status())
+
+@app.on_message(filters.command("pref") & filters.private)
+def pref_command(client, message):
+    user_id = message.from_user.id
+    if not user_store.is_allowed(user_id):
+        message.reply_text("Üzgünüm, bu botu kullanmaya yetkiniz yok.")
+        return
+
+    # Kısa adlar: /pref quality 720, /pref codec m4a, /pref split equal, /pref compat on
+    aliases = {"quality": "default_quality", "codec": "audio_codec", "split": "split_mode", "compat": "compatible"}
+    if len(message.command) >= 3:
+        key = aliases.get(message.command[1].lower(), message.command[1].lower())
+        value = message.command[2].lower()
+        if key not in USER_PREFERENCES:
+            message.reply_text("Bilinmeyen tercih. Kullanılabilir: quality, codec, split, compat")
+            return
+        if value in ("off", "default"):
+            value = None
+        elif value not in USER_PREFERENCES[key]:
+            message.reply_text(f"Geçersiz değer. Kullanılabilir: {', '.join(USER_PREFERENCES[key])}, default")
+            return
+        user_store.set_pref(user_id, key, value)
+
+    lines = ["Tercihleriniz:"]
+    for alias, key in aliases.items():
+        lines.append(f"{alias}: {user_store.get_pref(user_id, key) or 'varsayılan'}")
+    lines.append("Değiştirmek için: /pref <quality|codec|split|compat> <değer|default>")
+    message.reply_text("\n".join(lines))
+
+@app.on_message(filters.command("setting") & filters.private)
+def setting_command(client, message):
+    if message.from_user.id != OWNER_ID:
+        message.reply_text("Bu komutu kullanmaya yetkiniz yok.")
+        return
+
+    try:
+        key = message.command[1].lower()
+        value = message.command[2]
+        if key not in RUNTIME_SETTINGS:
+            raise ValueError(key)
+        if value.lower() == "default":
+            value = None
+        else:
+            RUNTIME_SETTINGS[key](value)
+    except (IndexError, ValueError):
+        message.reply_text(f"Kullanım: /setting <{'|'.join(RUNTIME_SETTINGS)}> <değer|default>")
+        return
+    user_store.set_setting(key, value)
+    message.reply_text(f"{key} = {value if value is not None else 'varsayılan'}")
+    logger.info(f"Ayar güncellendi: {key} = {value}")
+
+def download_direct_link(url: str, output_path: str, status_msg: types.Message, cancel_token: CancelToken = None, total_bytes: int = 0, progress_tracker: ProgressTracker = None):
+    process = None
+    try:
+        cmd = ["curl", "--progress-bar", "--no-buffer", "-L", "-o", output_path, url]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if cancel_token:
+            # İptal edildiğinde curl süreci sonlandırılır
+            cancel_token.register_process(process)
+        # curl yalnızca yüzde bildirir; boyut biliniyorsa yüzde bayta çevrilir
+        unit_total = total_bytes or 100
+        tracker = progress_tracker or ProgressTracker(status_msg, cancel_token, unit_bytes=bool(total_bytes))
+        tracker.start_stage("download", total=unit_total, emit=False)
+        pattern = re.compile(r'(\d+(?:\.\d+)?)%')
+
+        for line in process.stderr:
             m = pattern.search(line)
             if m:
-                try:
-                    percent = float(m.group(1))
-                    elapsed = time.time() - start_time
-                    if percent > 0:
-                        eta = elapsed * (100 - percent) / percent
-                    else:
-                        eta = 0
-                except Exception as e:
-                    logger.error("Yüzde ve ETA hesaplama hatası: %s", e)
-                    percent = 0
-                if time.time() - last_progress_update >= PROGRESS_UPDATE_INTERVAL:
-                    last_progress_update = time.time()
-                    try:
-                        logger.info(f"İndiriliyor: {percent:.2f}% - Kalan süre: {int(eta)} sn")
-                        status_msg.edit_text(f"İndiriliyor: {percent:.2f}% - Kalan süre: {int(eta)} sn")
-                    except Exception as e:
-                        logger.error("İndirme güncelleme hatası: %s", e)
-        return process.returncode == 0
+                tracker.update(float(m.group(1)) / 100 * unit_total)
+        returncode = reap_process(process, cancel_token.user_id if cancel_token else None)
+        return returncode == 0 and not (cancel_token and cancel_token.cancelled)
     except Exception as e:
         logger.error("Direct download failed: %s", e)
         return False
+    finally:
+        if cancel_token and process is not None:
+            cancel_token.unregister_process(process)
 
 def is_thumb_avaible(thumb_path):
     try:
@@ -414,11 +1995,11 @@ def is_thumb_avaible(thumb_path):
 def extract_thumbnail(video_path, thumb_path, timestamp="00:00:10"):
     try:
         # FFmpeg ile thumbnail oluştur
-        (
+        run_cancellable(
             ffmpeg
             .input(video_path, ss=timestamp)  # 10. saniyeden itibaren başla
             .output(thumb_path, vframes=1)  # Tek bir kare al
-            .run(overwrite_output=True, capture_stdout=True, capture_stderr=True)  # Sessiz çalıştır
+            .compile(overwrite_output=True)  # Sessiz çalıştır, CPU süresi işe işlenir
         )
 
         # Oluşan dosyanın var olup olmadığını kontrol et
@@ -438,6 +2019,147 @@ def extract_thumbnail(video_path, thumb_path, timestamp="00:00:10"):
         logger.error("Thumbnail oluşturulurken hata: %s", e)
         return False  # Hata oluştuysa başarısız olduğunu döndür
 
+def moov_at_start(file_path: str):
+    """
+    MP4 dosyasının üst düzey kutularını (box) okuyarak moov'un mdat'tan önce gelip gelmediğini döndürür.
+    Dosyanın yalnızca kutu başlıkları okunur; MP4 değilse veya okunamazsa None döner.
+    """
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, "rb") as f:
+            offset = 0
+            while offset + 8 <= file_size:
+                f.seek(offset)
+                header = f.read(16)
+                size = int.from_bytes(header[:4], "big")
+                box_type = header[4:8]
+                if size == 1:
+                    size = int.from_bytes(header[8:16], "big")
+                elif size == 0:
+                    size = file_size - offset
+                if offset == 0 and box_type != b"ftyp":
+                    return None
+                if box_type == b"moov":
+                    return True
+                if box_type == b"mdat":
+                    return False
+                if size < 8:
+                    return None
+                offset += size
+    except Exception as e:
+        logger.error("MP4 kutuları okunamadı: %s", e)
+    return None
+
+def faststart_remux(file_path: str, cancel_token: CancelToken = None) -> bool:
+    """
+    moov kutusu dosyanın sonundaysa, Telegram'da indirme bitmeden oynatılabilmesi için
+    dosyayı yeniden kodlamadan (stream copy) moov başa gelecek şekilde yerinde yeniden yazar.
+    Dosya değiştirildiyse True döner.
+    """
+    if moov_at_start(file_path) is not False:
+        return False
+    root, ext = os.path.splitext(file_path)
+    remuxed_path = f"{root}.faststart{ext}"
+    if shutil.disk_usage(os.path.dirname(file_path) or ".").free < os.path.getsize(file_path):
+        logger.warning("Faststart için yeterli disk alanı yok, atlanıyor: %s", file_path)
+        return False
+    cmd = [
+        "ffmpeg", "-y", "-v", "error", "-i", file_path,
+        "-map", "0", "-c", "copy", "-movflags", "+faststart", remuxed_path
+    ]
+    started = time.time()
+    try:
+        run_cancellable(cmd, cancel_token)
+    except JobCancelled:
+        if os.path.exists(remuxed_path):
+            os.remove(remuxed_path)
+        raise
+    except Exception as e:
+        logger.error("Faststart remux sırasında hata: %s", e)
+        if os.path.exists(remuxed_path):
+            os.remove(remuxed_path)
+        return False
+    os.replace(remuxed_path, file_path)
+    logger.info("moov başa alındı (%.1f sn): %s", time.time() - started, file_path)
+    return True
+
+def probe_video_dimensions(file_path: str):
+    """Videonun görüntülenme genişlik ve yüksekliğini döndürür, döndürme bilgisi hesaba katılır."""
+    try:
+        probe = ffmpeg.probe(file_path, select_streams="v:0")
+        stream = probe["streams"][0]
+        width, height = int(stream["width"]), int(stream["height"])
+        rotation = int(stream.get("tags", {}).get("rotate", 0))
+        for side_data in stream.get("side_data_list", []):
+            rotation = int(side_data.get("rotation", rotation))
+        if abs(rotation) % 180 == 90:
+            width, height = height, width
+        return width, height
+    except Exception as e:
+        logger.error("Video boyutları alınamadı: %s", e)
+        return 0, 0
+
+def load_upload_state(state_path: str) -> dict:
+    """Önceki denemede bölünmüş ve yüklenmiş parçaların kaydını okur."""
+    try:
+        with open(state_path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {"split": False, "sent": {}}
+
+def save_upload_state(state_path: str, state: dict):
+    try:
+        with open(state_path, "w") as f:
+            json.dump(state, f)
+    except Exception as e:
+        logger.error("Yükleme durumu kaydedilemedi: %s", e)
+
+def backoff_wait(attempt: int, cancel_token: CancelToken = None, wait: float = None) -> bool:
+    """Artan süreyle bekler; bekleme sırasında iş iptal edilirse True döner."""
+    if wait is None:
+        wait = RETRY_BACKOFF_BASE * 2 ** attempt
+    if cancel_token:
+        return cancel_token.wait(wait)
+    time.sleep(wait)
+    return False
+
+def send_media_with_retry(download_type, chat_id, path, caption, duration, progress, thumb_file_path, cancel_token=None, width=0, height=0, client=None):
+    """
+    Dosyayı gönderir, geçici ağ hatalarında UPLOAD_RETRIES kez artan beklemeyle tekrar dener.
+    Eksik kalan Telegram parçaları (FilePartMissing) pyrogram tarafından aynı gönderimde tamamlanır.
+    Yükleme iptal edildiyse None döner. client verilmezse bot kullanılır.
+    """
+    client = client or app
+    for attempt in range(UPLOAD_RETRIES + 1):
+        try:
+            if download_type == "video":
+                return client.send_video(
+                    chat_id=chat_id,
+                    video=path,
+                    caption=caption,
+                    duration=duration,
+                    width=width,
+                    height=height,
+                    supports_streaming=True,
+                    progress=progress,
+                    thumb=thumb_file_path
+                )
+            return client.send_audio(
+                chat_id=chat_id,
+                audio=path,
+                caption=caption,
+                duration=duration,
+                progress=progress,
+                thumb=thumb_file_path
+            )
+        except Exception as e:
+            if attempt == UPLOAD_RETRIES or (cancel_token and cancel_token.cancelled):
+                raise
+            wait = e.value if isinstance(e, FloodWait) else None
+            logger.warning("Gönderim başarısız (%s), tekrar denenecek (%d/%d)", e, attempt + 1, UPLOAD_RETRIES)
+            if backoff_wait(attempt, cancel_token, wait):
+                return None
+
 def upload_file(
     file_path,
     status_msg,
@@ -448,8 +2170,19 @@ def upload_file(
     caption_file_name=None,
     tmpdirname=None,
     thumb_file_path=None,
-    max_file_size=2097152000,
+    max_file_size=None,
+    log_message_ids=None,
+    equal_split=None,
+    cancel_token=None,
+    progress_tracker=None,
 ):
+    """
+    Dosyayı (gerekirse parçalara bölerek) yükler. Bölme ve gönderilen parçalar çalışma dizinindeki
+    bir durum dosyasına yazılır; aynı dizinle tekrar çağrıldığında yalnızca gönderilemeyen parçalar yüklenir.
+    Premium hesap hazırsa bot sınırını aşan dosyalar/parçalar o hesapla yüklenir.
+    """
+    if max_file_size is None:
+        max_file_size = userbot_max_file_size or BOT_MAX_FILE_SIZE
     # Geçici dizin ve dosya adını ayarla
     if tmpdirname is None:
         tmpdirname = os.path.dirname(file_path)
@@ -458,6 +2191,23 @@ def upload_file(
     if thumb_file_path is None:
         thumb_file_path = os.path.join(tmpdirname, os.path.splitext(caption_file_name)[0]+".jpg")
 
+    state_path = os.path.join(tmpdirname, f".{caption_file_name}.upload.json")
+    state = load_upload_state(state_path)
+
+    width = height = 0
+    if download_type == "video":
+        # Parçalar bayt olarak bölündüğü için moov, bölmeden önce başa alınmalıdır
+        if not state["split"] and moov_at_start(file_path) is False:
+            try:
+                status_msg.edit_text("Video akış için hazırlanıyor...", reply_markup=cancel_markup(cancel_token))
+            except Exception as e:
+                logger.error("Faststart mesajı güncelleme hatası: %s", e)
+            try:
+                faststart_remux(file_path, cancel_token)
+            except JobCancelled:
+                return False
+        width, height = probe_video_dimensions(file_path)
+
     try:
         file_size = os.path.getsize(file_path)
     except Exception as e:
@@ -474,40 +2224,50 @@ def upload_file(
 
     # Dosya parçalara ayrılacak mı kontrolü
     if file_size > max_file_size:
-        try:
-            logger.info("Dosya 2GB'dan büyük, parçalara ayrılıyor...")
-            status_msg.edit_text("Dosya 2GB'dan büyük, parçalara ayrılıyor...")
-        except Exception as e:
-            logger.error("Parçalama mesajı güncelleme hatası: %s", e)
-
-        if EQUAL_SPLIT:
-            num_parts = math.ceil(file_size / max_file_size)
-            part_size = math.ceil(file_size / num_parts)  # Her parçanın eşit büyüklüğü
-        else:
-            part_size = max_file_size
-
         part_prefix = os.path.splitext(caption_file_name)[0]
         part_ext = os.path.splitext(caption_file_name)[1]
         output_prefix = os.path.join(tmpdirname, part_prefix + ".part")
 
-        cmd = [
-            "split",
-            "-b", str(part_size),
-            "--numeric-suffixes=1",
-            "--additional-suffix=" + part_ext,
-            file_path,
-            output_prefix
-        ]
+        if state["split"]:
+            logger.info("Daha önce ayrılmış parçalar kullanılıyor.")
+        else:
+            try:
+                limit_text = f"{max_file_size / (1024 ** 3):.0f}GB"
+                logger.info(f"Dosya {limit_text}'dan büyük, parçalara ayrılıyor...")
+                status_msg.edit_text(f"Dosya {limit_text}'dan büyük, parçalara ayrılıyor...", reply_markup=cancel_markup(cancel_token))
+            except Exception as e:
+                logger.error("Parçalama mesajı güncelleme hatası: %s", e)
+
+            if equal_split is None:
+                equal_split = user_store.setting("equal_split", EQUAL_SPLIT)
+            if equal_split:
+                num_parts = math.ceil(file_size / max_file_size)
+                part_size = math.ceil(file_size / num_parts)  # Her parçanın eşit büyüklüğü
+            else:
+                part_size = max_file_size
+
+            cmd = [
+                "split",
+                "-b", str(part_size),
+                "--numeric-suffixes=1",
+                "--additional-suffix=" + part_ext,
+                file_path,
+                output_prefix
+            ]
 
-        try:
-            subprocess.run(cmd, check=True)
-        except Exception as e:
-            logger.error("Dosya parçalara ayrılırken hata: %s", e)
             try:
-                status_msg.edit_text("Dosya parçalara ayrılırken hata oluştu.")
-            except Exception as ex:
-                logger.error("Hata mesajı güncelleme hatası: %s", ex)
-            return False
+                run_cancellable(cmd, cancel_token)
+            except JobCancelled:
+                return False
+            except Exception as e:
+                logger.error("Dosya parçalara ayrılırken hata: %s", e)
+                try:
+                    status_msg.edit_text("Dosya parçalara ayrılırken hata oluştu.")
+                except Exception as ex:
+                    logger.error("Hata mesajı güncelleme hatası: %s", ex)
+                return False
+            state = {"split": True, "sent": {}}
+            save_upload_state(state_path, state)
 
         part_files = sorted(glob.glob(os.path.join(tmpdirname, f"{part_prefix}.part*{part_ext}")))
         if not part_files:
@@ -518,129 +2278,261 @@ def upload_file(
                 logger.error("Parçalanmış dosya bulunamadı mesajı güncelleme hatası: %s", e)
             return False
 
-        total_parts = len(part_files)
         try:
             logger.info("Yükleme başlatılıyor (parçalı)...")
-            status_msg.edit_text("Yükleme başlatılıyor (parçalı)...")
+            status_msg.edit_text("Yükleme başlatılıyor (parçalı)...", reply_markup=cancel_markup(cancel_token))
         except Exception as e:
             logger.error("Yükleme başlatma mesajı güncelleme hatası: %s", e)
-
-        start_time = time.time()
-        last_progress_update = time.time()
-
-        def upload_progress(current, total):
-            nonlocal last_progress_update
-            percent = (current / total * 100) if total else 0
-            elapsed = time.time() - start_time
-            eta = (elapsed / current * (total - current)) if current else 0
-            if time.time() - last_progress_update >= PROGRESS_UPDATE_INTERVAL:
-                last_progress_update = time.time()
-                try:
-                    logger.info(f"Yükleniyor: {percent:.2f}% - Kalan süre: {int(eta)} sn")
-                    status_msg.edit_text(f"Yükleniyor: {percent:.2f}% - Kalan süre: {int(eta)} sn")
-                except Exception as e:
-                    logger.error("Yükleme güncelleme hatası: %s", e)
-
-        # Parçaları teker teker yükle
-        for i, part in enumerate(part_files, start=1):
-            overall_progress = (i / total_parts) * 100
-            try:
-                logger.info(f"Parçaların {overall_progress:.2f}%'si hazırlandı ve yükleniyor...")
-                status_msg.edit_text(f"Parçaların {overall_progress:.2f}%'si hazırlandı ve yükleniyor...")
-            except Exception as e:
-                logger.error("Genel ilerleme güncelleme hatası: %s", e)
-            try:
-                if download_type == "video":
-                    sent = app.send_video(
-                        chat_id=chat_id,
-                        video=part,
-                        caption=caption,
-                        duration=duration,
-                        progress=upload_progress,
-                        thumb=thumb_file_path
-                    )
-                else:
-                    sent = app.send_audio(
-                        chat_id=chat_id,
-                        audio=part,
-                        caption=caption,
-                        duration=duration,
-                        progress=upload_progress,
-                        thumb=thumb_file_path
-                    )
-                try:
-                    app.forward_messages(LOG_CHANNEL_ID, chat_id, sent.id)
-                    logger.info("İndirilen dosya kanala iletildi")
-                except Exception as e:
-                    logger.error("Parça log mesajı gönderilemedi: %s", e)
-            except Exception as e:
-                logger.error("Parça gönderimi sırasında hata: %s", e)
-                try:
-                    status_msg.edit_text("Dosya parça gönderilirken hata oluştu.")
-                except Exception as ex:
-                    logger.error("Hata mesajı güncelleme hatası: %s", ex)
-                return False
-
     else:
-        # Dosya 2GB'dan küçükse doğrudan yükleme
+        # Dosya sınırdan küçükse doğrudan yükleme
+        part_files = [file_path]
         try:
             logger.info("Yükleme başlatılıyor...")
-            status_msg.edit_text("Yükleme başlatılıyor...")
+            status_msg.edit_text("Yükleme başlatılıyor...", reply_markup=cancel_markup(cancel_token))
         except Exception as e:
             logger.error("Yükleme başlatma mesajı güncelleme hatası: %s", e)
-        start_time = time.time()
-        last_progress_update = time.time()
-
-        def upload_progress(current, total):
-            nonlocal last_progress_update
-            percent = (current / total * 100) if total else 0
-            elapsed = time.time() - start_time
-            eta = (elapsed / current * (total - current)) if current else 0
-            if time.time() - last_progress_update >= PROGRESS_UPDATE_INTERVAL:
-                last_progress_update = time.time()
-                try:
-                    logger.info(f"Yükleniyor: {percent:.2f}% - Kalan süre: {int(eta)} sn")
-                    status_msg.edit_text(f"Yükleniyor: {percent:.2f}% - Kalan süre: {int(eta)} sn")
-                except Exception as e:
-                    logger.error("Yükleme güncelleme hatası: %s", e)
 
+    # Tüm parçalar tek bir yükleme aşaması olarak izlenir
+    tracker = progress_tracker or ProgressTracker(status_msg, cancel_token, stages={"upload": ("Yükleniyor", 1)})
+    pending_size = sum(os.path.getsize(part) for part in part_files if os.path.basename(part) not in state["sent"])
+    tracker.start_stage("upload", total=pending_size, emit=False)
+    uploaded_size = 0
+
+    uploader = app
+
+    def upload_progress(current, total):
+        if cancel_token and cancel_token.cancelled:
+            # Pyrogram yüklemeyi durdurur ve send_* None döndürür
+            uploader.stop_transmission()
+        tracker.update(current)
+
+    # Parçaları teker teker yükle, önceki denemede gönderilenler atlanır
+    total_parts = len(part_files)
+    for i, part in enumerate(part_files, start=1):
+        if cancel_token and cancel_token.cancelled:
+            return False
+        part_name = os.path.basename(part)
+        if part_name in state["sent"]:
+            logger.info("Parça daha önce gönderildi, atlanıyor: %s", part_name)
+            continue
+        tracker.begin_part(uploaded_size, f"Yükleniyor (parça {i}/{total_parts})" if total_parts > 1 else None)
+        # Bot sınırını aşan parçalar premium hesapla doğrudan log kanalına yüklenir
+        uploader = userbot if userbot_max_file_size and os.path.getsize(part) > BOT_MAX_FILE_SIZE else app
         try:
-            if download_type == "video":
-                sent = app.send_video(
-                    chat_id=chat_id,
-                    video=file_path,
-                    caption=caption,
-                    duration=duration,
-                    progress=upload_progress,
-                    thumb=thumb_file_path
+            if uploader is app:
+                sent = send_media_with_retry(
+                    download_type, chat_id, part, caption, duration, upload_progress, thumb_file_path, cancel_token,
+                    width=width, height=height
                 )
             else:
-                sent = app.send_audio(
-                    chat_id=chat_id,
-                    audio=file_path,
-                    caption=caption,
-                    duration=duration,
-                    progress=upload_progress,
-                    thumb=thumb_file_path
+                log_message_id = state.setdefault("logged", {}).get(part_name)
+                if log_message_id is None:
+                    logged = send_media_with_retry(
+                        download_type, LOG_CHANNEL_ID, part, caption, duration, upload_progress, thumb_file_path,
+                        cancel_token, width=width, height=height, client=userbot
+                    )
+                    if logged is None:
+                        return False
+                    log_message_id = logged.id
+                    state["logged"][part_name] = log_message_id
+                    save_upload_state(state_path, state)
+                    logger.info("Dosya premium hesapla kanala yüklendi")
+                sent = app.copy_message(chat_id, LOG_CHANNEL_ID, log_message_id)
+        except Exception as e:
+            logger.error("Gönderim sırasında hata: %s", e)
+            try:
+                status_msg.edit_text(
+                    "Dosya parça gönderilirken hata oluştu." if total_parts > 1 else "Dosya gönderilirken hata oluştu."
                 )
+            except Exception as ex:
+                logger.error("Hata mesajı güncelleme hatası: %s", ex)
+            return False
+        if sent is None:
+            return False
+        uploaded_size += os.path.getsize(part)
+
+        if uploader is app:
+            log_message_id = None
             try:
-                app.forward_messages(LOG_CHANNEL_ID, chat_id, sent.id)
+                forwarded = app.forward_messages(LOG_CHANNEL_ID, chat_id, sent.id)
+                log_message_id = forwarded.id
                 logger.info("İndirilen dosya kanala iletildi")
             except Exception as e:
                 logger.error("Yükleme log mesajı gönderilemedi: %s", e)
+        state["sent"][part_name] = log_message_id
+        save_upload_state(state_path, state)
+
+    if log_message_ids is not None:
+        log_message_ids.extend(
+            state["sent"][os.path.basename(part)] for part in part_files
+            if state["sent"].get(os.path.basename(part)) is not None
+        )
+    return True
+
+def cut_chapter(file_path: str, start: float, end: float, output_path: str, cancel_token: CancelToken = None):
+    """Bölümü yeniden kodlamadan (stream copy) keser; önceki denemede kesilmiş bölüm tekrar kesilmez."""
+    if os.path.exists(output_path):
+        return
+    root, ext = os.path.splitext(output_path)
+    cut_path = f"{root}.cut{ext}"
+    cmd = [
+        "ffmpeg", "-y", "-v", "error", "-ss", str(start), "-i", file_path, "-t", str(end - start),
+        "-map", "0", "-map_chapters", "-1", "-c", "copy", "-avoid_negative_ts", "make_zero",
+        "-movflags", "+faststart", cut_path
+    ]
+    try:
+        run_cancellable(cmd, cancel_token)
+    except Exception:
+        if os.path.exists(cut_path):
+            os.remove(cut_path)
+        raise
+    os.replace(cut_path, output_path)
+
+def upload_chapters(
+    file_path,
+    chapters,
+    chat_id,
+    status_msg,
+    caption_file_name,
+    resolution,
+    url,
+    tmpdirname,
+    thumb_file_path=None,
+    log_message_ids=None,
+    equal_split=None,
+    cancel_token=None,
+):
+    """
+    Videoyu bölüm sınırlarından keser ve her bölümü ayrı, oynatılabilir bir dosya olarak
+    CHAPTER_UPLOAD_CONCURRENCY paralel yüklemeyle gönderir. Tüm bölümler gönderildiyse True döner.
+    """
+    root, ext = os.path.splitext(caption_file_name)
+    total = len(chapters)
+    results = [None] * total
+    if thumb_file_path and not is_thumb_avaible(thumb_file_path):
+        # Paralel yüklemeler aynı dosyaya thumbnail çıkarmasın, her bölüm kendi thumbnail'ini oluşturur
+        thumb_file_path = None
+
+    def process_chapter(index):
+        if cancel_token and cancel_token.cancelled:
+            return
+        start, end, chapter_title = chapters[index]
+        name = f"{root} - {index + 1:02d}. {sanitize_filename(chapter_title) or 'Bölüm'}{ext}"
+        path = os.path.join(tmpdirname, name)
+        chapter_msg = app.send_message(chat_id, f"Bölüm {index + 1}/{total} hazırlanıyor: {chapter_title}")
+        message_ids = []
+        ok = False
+        try:
+            cut_chapter(file_path, start, end, path, cancel_token)
+            size_str = f"{os.path.getsize(path) / (1024 * 1024):,.2f} MB"
+            caption = (
+                f"{name}\nKalite: {resolution}, Boyut: {size_str} Format: {ext[1:]}, "
+                f"Süre: {format_duration(int(end - start))}, Bölüm: {index + 1}/{total} "
+                f"({format_duration(int(start))}-{format_duration(int(end))})\n{url}"
+            )
+            ok = upload_file(
+                path, chapter_msg, "video", chat_id, caption, int(end - start), name, tmpdirname,
+                thumb_file_path, log_message_ids=message_ids, equal_split=equal_split, cancel_token=cancel_token
+            )
+        except JobCancelled:
+            pass
         except Exception as e:
-            logger.error("Gönderim sırasında hata: %s", e)
+            logger.error("Bölüm %d işlenirken hata: %s", index + 1, e)
+        if ok:
+            results[index] = message_ids
             try:
-                status_msg.edit_text("Dosya gönderilirken hata oluştu.")
-            except Exception as ex:
-                logger.error("Hata mesajı güncelleme hatası: %s", ex)
+                chapter_msg.delete()
+            except Exception as e:
+                logger.error("Mesaj silinirken hata: %s", e)
+        elif not (cancel_token and cancel_token.cancelled):
+            try:
+                chapter_msg.edit_text(f"Bölüm {index + 1}/{total} gönderilemedi: {chapter_title}")
+            except Exception as e:
+                logger.error("Hata mesajı güncelleme hatası: %s", e)
+
+    try:
+        logger.info("%d bölüm ayrı dosyalar olarak yükleniyor...", total)
+        status_msg.edit_text(f"{total} bölüm ayrı dosyalar olarak yükleniyor...", reply_markup=cancel_markup(cancel_token))
+    except Exception as e:
+        logger.error("Bölüm yükleme mesajı güncellenemedi: %s", e)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, CHAPTER_UPLOAD_CONCURRENCY)) as executor:
+        list(executor.map(process_chapter, range(total)))
+    if cancel_token:
+        cancel_token.check()
+
+    if log_message_ids is not None:
+        for message_ids in results:
+            log_message_ids.extend(message_ids or [])
+    failed = sum(1 for message_ids in results if message_ids is None)
+    if failed:
+        try:
+            status_msg.edit_text(f"{failed}/{total} bölüm gönderilemedi.")
+        except Exception as e:
+            logger.error("Hata mesajı güncelleme hatası: %s", e)
+    return failed == 0
+
+@track_cpu_usage
+def download_direct_file(user_id: int, text: str, chat_id: int, status_msg: types.Message, cancel_token: CancelToken) -> bool:
+    """Doğrudan dosya linkini curl ile indirip yükler; yükleme başarılıysa True döner."""
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        file_name = sanitize_filename(os.path.basename(text))
+        file_path = os.path.join(tmpdirname, file_name)
+        # Check if there is enough disk space for the file
+        file_size = int(requests.head(text).headers.get('content-length', 0))
+        if not check_disk_space(file_size):
+            status_msg.edit_text("Sistem hatası, yeterli disk alanı mevcut değil.")
             return False
-    return True
+        tracker = ProgressTracker(status_msg, cancel_token, stages={
+            "download": ("İndiriliyor", 1),
+            "upload": ("Yükleniyor", 1),
+        }, unit_bytes=bool(file_size))
+        if download_direct_link(text, file_path, status_msg, cancel_token, total_bytes=file_size, progress_tracker=tracker):
+            usage_store.add(user_id, bytes_down=os.path.getsize(file_path))
+            try:
+                try:
+                    probe = ffmpeg.probe(file_path)
+                    duration = int(float(probe['format']['duration']))
+                    logger.info ("Yüklenecek dosya %s saniye", duration)
+                except Exception as e:
+                    logger.error("Dosya süresi ffmpeg ile hesaplanamadı: %s", e)
+                    duration = 0
+
+                duration_str = format_duration(duration)
+                # Dosya boyutunu MB cinsine çevir
+                try:
+                    real_file_size = os.path.getsize(file_path) / (1024 * 1024)  # MB cinsine çevrildi
+                    real_file_size_str = f"{real_file_size:,.2f} MB"  # Nokta yerine virgül ile formatlama
+                    logger.info("Yüklenecek dosya %s", real_file_size_str)
+                except Exception as e:
+                    logger.error("Dosya boyutu hesaplanamadı: %e", e)
+                    real_file_size_str = 0
+
+                quality_line = f"Boyut: {real_file_size_str}, Format: {os.path.splitext(file_path)[1][1:]}, Süre: {duration_str}"
+                caption = f"{file_name}\n{quality_line}\n{text}"
+
+                if text.lower().endswith((".mkv", ".mp4", ".avi", ".flv")):
+                    download_type = "video"
+                else:
+                    download_type = "audio"
+
+                logger.info(f"{file_path} yüklenmeye başlıyor.")
+                tracker.unit_bytes = True
+                if(upload_file(file_path, status_msg, download_type, chat_id, caption, duration, file_name, tmpdirname, equal_split=user_store.equal_split(user_id), cancel_token=cancel_token, progress_tracker=tracker)):
+                    logger.info("Dosya yüklendi")
+                    usage_store.add(user_id, bytes_up=os.path.getsize(file_path))
+                    return True
+            except Exception as e:
+                logger.error("Dosya yüklenirken hata: %s", e)
+                status_msg.edit_text("Dosya yüklenirken hata oluştu.")
+        else:
+            if not cancel_token.cancelled:
+                status_msg.edit_text("Dosya indirilemedi.")
+    return False
 
 @app.on_message(filters.text & filters.private)
 def handle_link(client, message):
     user_id = message.from_user.id
-    if user_id not in ALLOWED_USERS:
+    if not user_store.is_allowed(user_id):
         message.reply_text("Üzgünüm, bu botu kullanmaya yetkiniz yok.")
         return
 
@@ -649,51 +2541,23 @@ def handle_link(client, message):
 
     if any(text.lower().endswith(ext) for ext in direct_download_extensions):
         # Handle direct download links
-        status_msg = message.reply_text("Dosya indiriliyor...")
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            file_name = sanitize_filename(os.path.basename(text))
-            file_path = os.path.join(tmpdirname, file_name)
-            # Check if there is enough disk space for the file
-            file_size = int(requests.head(text).headers.get('content-length', 0))
-            if not check_disk_space(file_size):
-                status_msg.edit_text("Sistem hatası, yeterli disk alanı mevcut değil.")
-                return
-            if download_direct_link(text, file_path, status_msg):
-                try:
-                    try:
-                        probe = ffmpeg.probe(file_path)
-                        duration = int(float(probe['format']['duration']))
-                        logger.info ("Yüklenecek dosya %s saniye", duration)
-                    except Exception as e:
-                        logger.error("Dosya süresi ffmpeg ile hesaplanamadı: %s", e)
-                        duration = 0
-                    
-                    duration_str = format_duration(duration)
-                    # Dosya boyutunu MB cinsine çevir
-                    try:
-                        real_file_size = os.path.getsize(file_path) / (1024 * 1024)  # MB cinsine çevrildi
-                        real_file_size_str = f"{real_file_size:,.2f} MB"  # Nokta yerine virgül ile formatlama
-                        logger.info("Yüklenecek dosya %s", real_file_size_str)
-                    except Exception as e:
-                        logger.error("Dosya boyutu hesaplanamadı: %e", e)
-                        real_file_size_str = 0
-
-                    quality_line = f"Boyut: {real_file_size_str}, Format: {os.path.splitext(file_path)[1][1:]}, Süre: {duration_str}"
-                    caption = f"{file_name}\n{quality_line}\n{text}"
-
-                    if text.lower().endswith((".mkv", ".mp4", ".avi", ".flv")):
-                        download_type = "video"
-                    else:
-                        download_type = "audio"
-
-                    logger.info(f"{file_path} yüklenmeye başlıyor.")
-                    if(upload_file(file_path, status_msg, download_type, message.chat.id, caption, duration, file_name, tmpdirname)):
-                        logger.info("Dosya yüklendi")
-                except Exception as e:
-                    logger.error("Dosya yüklenirken hata: %s", e)
-                    status_msg.edit_text("Dosya yüklenirken hata oluştu.")
-            else:
-                status_msg.edit_text("Dosya indirilemedi.")
+        cancel_token = CancelToken(user_id)
+        active_jobs[cancel_token.job_id] = cancel_token
+        status_msg = message.reply_text("Dosya indiriliyor...", reply_markup=cancel_markup(cancel_token))
+        try:
+            run_metered_job(
+                user_id, status_msg, cancel_token,
+                lambda: download_direct_file(user_id, text, message.chat.id, status_msg, cancel_token),
+            )
+        except JobCancelled:
+            pass
+        finally:
+            active_jobs.pop(cancel_token.job_id, None)
+        if cancel_token.cancelled:
+            try:
+                status_msg.edit_text("İşlem iptal edildi.", reply_markup=None)
+            except Exception as e:
+                logger.error("İptal mesajı güncellenemedi: %s", e)
         return
 
     # Eğer gönderilen metin bir URL içermiyorsa Youtube Data API V3 ile arama yap.
@@ -711,6 +2575,7 @@ def handle_link(client, message):
             return
 
         buttons = []
+        result_urls = []
         for item in items:
             video_id = item.get("id", {}).get("videoId")
             title = item.get("snippet", {}).get("title")
@@ -720,11 +2585,24 @@ def handle_link(client, message):
                 title = title[:40] + "..."
             video_url = f"https://www.youtube.com/watch?v={video_id}"
             buttons.append([types.InlineKeyboardButton(text=title, callback_data="search|" + video_url)])
+            result_urls.append(video_url)
 
         keyboard = types.InlineKeyboardMarkup(buttons)
         message.reply_text("Arama sonuçları:", reply_markup=keyboard)
+        # Kullanıcı seçim yaparken ilk sonuçların bilgileri arka planda alınır
+        if PREFETCH_RESULTS:
+            prefetcher.prefetch(user_id, result_urls[:PREFETCH_RESULTS])
         return
     else:
+        try:
+            text, clip = parse_clip_request(text)
+        except ValueError:
+            message.reply_text("Geçersiz kesit: dakika ve saniye 0-59 arasında olmalı.")
+            return
+        if clip and clip[1] <= clip[0]:
+            message.reply_text("Geçersiz kesit: bitiş zamanı başlangıçtan sonra olmalı.")
+            return
+
         # Link gönderilmişse, LOG_CHANNEL'a kullanıcının adı ve id bilgileriyle birlikte log gönderiliyor.
         user = message.from_user
         username = f"@{user.username}" if user.username else user.first_name
@@ -734,9 +2612,83 @@ def handle_link(client, message):
         except Exception as e:
             logger.error("LOG_CHANNEL'a mesaj gönderilirken hata: %s", e)
 
-        # Metin bir link içeriyorsa, linki kullan.
-        status_msg = message.reply_text("Lütfen indirmek istediğiniz kaliteyi seçin:")
-        prepare_video_info_and_show_quality(message.chat.id, user_id, text, status_msg=status_msg)
+        link_kind = playlist_link_kind(text)
+        if link_kind == "ambiguous" and not clip:
+            # Listeden paylaşılmış video: yalnızca videonun mu, tüm listenin mi indirileceği sorulur
+            pending_links[user_id] = text
+            message.reply_text(
+                "Bu link bir oynatma listesindeki videoya ait. Ne indirmek istersiniz?",
+                reply_markup=types.InlineKeyboardMarkup([[
+                    types.InlineKeyboardButton(text="Sadece bu video", callback_data="linkmode|video"),
+                    types.InlineKeyboardButton(text="Tüm liste", callback_data="linkmode|playlist"),
+                ]])
+            )
+            return
+        if link_kind == "playlist" and clip:
+            message.reply_text("Kesit indirme yalnızca tekil videolar için kullanılabilir.")
+            return
+        start_link(message.chat.id, user_id, text, playlist=link_kind == "playlist", clip=clip)
+
+def show_status(chat_id: int, text: str, status_msg: types.Message = None) -> types.Message:
+    """Verilen mesajı günceller, mesaj yoksa yenisini gönderir."""
+    if status_msg is None:
+        return app.send_message(chat_id, text)
+    try:
+        status_msg.edit_text(text)
+    except Exception as e:
+        logger.error("Mesaj güncelleme hatası: %s", e)
+    return status_msg
+
+def start_link(chat_id: int, user_id: int, url: str, playlist: bool, clip=None, status_msg: types.Message = None):
+    """
+    Linki oynatma listesi ya da tekil video olarak işlemeye başlar.
+    status_msg verilirse (ör. tür seçim mesajı) yeni mesaj yerine o güncellenir.
+    """
+    if playlist:
+        status_msg = show_status(chat_id, "Oynatma listesi okunuyor...", status_msg)
+        prepare_playlist_and_show_profiles(
+            chat_id, user_id, url, status_msg,
+            profile=user_store.get_pref(user_id, "default_quality")
+        )
+        return
+
+    url = strip_playlist_params(url)
+    default_quality = user_store.get_pref(user_id, "default_quality")
+    if default_quality:
+        # Varsayılan kalite tercihi olan kullanıcılar için metadata ve kalite menüsü atlanır
+        user_video_info[user_id] = {
+            "url": url,
+            "title": "",
+            "duration": 0,
+            "thumbnail": None,
+            "selection_made": False,
+            "clip": clip
+        }
+        if status_msg is not None:
+            try:
+                status_msg.delete()
+            except Exception as e:
+                logger.error("Mesaj silinirken hata: %s", e)
+        enqueue_or_start(user_id, chat_id, "profile", default_quality)
+        return
+
+    # Metin bir link içeriyorsa, linki kullan.
+    status_msg = show_status(chat_id, "Lütfen indirmek istediğiniz kaliteyi seçin:", status_msg)
+    prepare_video_info_and_show_quality(chat_id, user_id, url, status_msg=status_msg, clip=clip)
+
+@app.on_callback_query(filters.regex(r"^linkmode\|"))
+def link_mode_callback(client, callback_query):
+    user_id = callback_query.from_user.id
+    url = pending_links.pop(user_id, None)
+    if url is None:
+        callback_query.answer("İşlem bilgileri bulunamadı.")
+        return
+    mode = callback_query.data.split("|", 1)[1]
+    callback_query.answer()
+    start_link(
+        callback_query.message.chat.id, user_id, url, playlist=mode == "playlist",
+        status_msg=callback_query.message
+    )
 
 @app.on_callback_query(filters.regex(r"^search\|"))
 def search_result_callback(client, callback_query):
@@ -756,34 +2708,104 @@ def search_result_callback(client, callback_query):
     except Exception as e:
         logger.error("LOG_CHANNEL'a mesaj gönderilirken hata: %s", e)
 
+    # Seçilmeyen sonuçların bekleyen ön getirmeleri iptal edilir
+    prefetcher.cancel(user_id)
     prepare_video_info_and_show_quality(chat_id, user_id, video_url, status_msg=callback_query.message)
 
-def process_task(user_id: int, download_type: str, selection: str, chat_id: int, status_msg: types.Message):
+def run_metered_job(user_id: int, status_msg: types.Message, cancel_token: CancelToken, job) -> bool:
+    """
+    İşi kota kontrolü ve adil sıra slotu içinde çalıştırıp kullanıcının iş sayısını işler.
+    Kota dolmuşsa iş başlatılmaz ve False döner; bekleme sırasında iptal JobCancelled fırlatır.
+    """
+    def notify_waiting():
+        try:
+            status_msg.edit_text("Sistem yoğun, işleminiz sıraya alındı...", reply_markup=cancel_markup(cancel_token))
+        except Exception as e:
+            logger.error("Bekleme mesajı güncellenemedi: %s", e)
+
+    if usage_store.over_quota(user_id):
+        logger.info("Kullanıcı %s günlük kotasını doldurdu", user_id)
+        try:
+            status_msg.edit_text("Günlük indirme kotanız doldu, lütfen yarın tekrar deneyin.")
+        except Exception as e:
+            logger.error("Kota mesajı güncellenemedi: %s", e)
+        return False
+    with fair_scheduler.slot(user_id, on_wait=notify_waiting, cancel_token=cancel_token):
+        result = job()
+    usage_store.add(user_id, jobs=1)
+    return result
+
+def process_task(user_id: int, download_type: str, selection: str, chat_id: int, status_msg: types.Message, cancel_token: CancelToken = None):
     """
     İşlem tamamlanınca kuyruğu kontrol edip sıradakini başlatır.
     İşlemin tüm aşamalarında (indirme, işleme, yükleme) tek bir mesaj (status_msg) güncellenecektir.
     """
+    if cancel_token is None:
+        cancel_token = CancelToken(user_id)
+        active_jobs[cancel_token.job_id] = cancel_token
+    # Tekrar deneme için işin başlangıçtaki bilgileri saklanır
+    retry_data = copy.deepcopy({
+        k: v for k, v in user_video_info.get(user_id, {}).items() if k != "menu_timer"
+    })
+
+    success = False
     try:
-        success = _process_task(user_id, download_type, selection, chat_id, status_msg)
+        try:
+            success = run_metered_job(
+                user_id, status_msg, cancel_token,
+                lambda: _process_task(user_id, download_type, selection, chat_id, status_msg, cancel_token),
+            )
+        except JobCancelled:
+            pass
+        finally:
+            active_jobs.pop(cancel_token.job_id, None)
+            if cancel_token.cancelled:
+                logger.info("İşlem kullanıcı tarafından iptal edildi")
+                try:
+                    status_msg.edit_text("İşlem iptal edildi.", reply_markup=None)
+                except Exception as e:
+                    logger.error("İptal mesajı güncellenemedi: %s", e)
+        # Sonuç kuyruktaki işlere geçmeden bildirilir; aksi halde tekrar deneme düğmesi
+        # çalışma dizininin bekleme süresi dolduktan sonra görünebilirdi
+        if success and not cancel_token.cancelled:
+            try:
+                status_msg.delete()
+            except Exception as e:
+                logger.error("Mesaj silinirken hata: %s", e)
+        elif not cancel_token.cancelled and retry_data:
+            remember_failed_job(cancel_token.job_id, {
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "download_type": download_type,
+                "selection": selection,
+                "data": retry_data,
+            }, status_msg)
     finally:
         check_next(user_id)
-    if success:
-        try:
-            status_msg.delete()
-        except Exception as e:
-            logger.error("Mesaj silinirken hata: %s", e)
 
-def _process_task(user_id: int, download_type: str, selection: str, chat_id: int, status_msg: types.Message) -> bool:
+def _process_task(user_id: int, download_type: str, selection: str, chat_id: int, status_msg: types.Message, cancel_token: CancelToken = None) -> bool:
+    if cancel_token:
+        cancel_token.check()
     user_data = user_video_info.get(user_id)
     if not user_data:
         app.send_message(chat_id, "İşlem bilgileri bulunamadı.")
         return False
     user_data["selection_made"] = True
-    title = sanitize_filename(user_data.get("title"))
-    duration = user_data.get("duration", 0)
-    duration_str = format_duration(duration)
-
-    if download_type == "video":
+    if download_type == "playlist":
+        return _process_playlist(user_id, user_data, selection, chat_id, status_msg, cancel_token)
+    # Tercihlerle menü atlandığında başlık henüz bilinmez, indirme sonrasında güncellenir
+    title = sanitize_filename(user_data.get("title") or "") or "video"
+    if user_data.get("clip"):
+        title += f" ({format_clip(user_data['clip']).replace(':', '.')})"
+
+    if download_type == "profile":
+        if selection not in PLAYLIST_PROFILES:
+            app.send_message(chat_id, "Bilinmeyen profil.")
+            return False
+        (download_type, fmt_spec, postprocessors, download_file_name,
+         caption_file_name, resolution) = build_profile_job(selection, title, user_store.audio_codec(user_id))
+        required_space = 0
+    elif download_type == "video":
         file_ext = "mp4"
         download_file_name = f"{title}.{file_ext}"
         caption_file_name = f"{title}.{file_ext}"
@@ -802,79 +2824,215 @@ def _process_task(user_id: int, download_type: str, selection: str, chat_id: int
         if bestaudio_info is None:
             app.send_message(chat_id, "Ses format bilgisi bulunamadı.")
             return False
-        file_ext = bestaudio_info.get("ext", "m4a")
+        audio_codec = user_store.audio_codec(user_id)
         download_file_name = f"{title}"
         resolution = "en iyi"
         fmt_spec = "bestaudio"
-        postprocessors = [{
-            "key": "FFmpegExtractAudio",
-            "preferredcodec": "mp3",
-            "preferredquality": "0"  # Orijinal kaliteyi korur
-        }]
-        caption_file_name = f"{title}.mp3"
+        postprocessors = audio_postprocessors(audio_codec)
+        caption_file_name = f"{title}.{audio_codec}"
         required_space = bestaudio_info.get("filesize", 0)
     else:
         app.send_message(chat_id, "Bilinmeyen tür.")
         return False
 
-    if not check_disk_space(required_space):
+    compatible = user_data.get("compatible")
+    if compatible is None:
+        compatible = user_store.compatible(user_id)
+    return _download_and_upload(
+        user_id, user_data, download_type, fmt_spec, postprocessors, download_file_name,
+        caption_file_name, resolution, required_space, chat_id, status_msg,
+        cancel_token=cancel_token, compatible=compatible,
+        subtitle_langs=user_data.get("subtitle_langs") if user_data.get("embed_subs") else None,
+        chapter_mode=user_data.get("chapter_mode", "off")
+    )
+
+def load_download_marker(marker_path: str):
+    try:
+        with open(marker_path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def save_download_marker(marker_path: str, file_name: str, info: dict, transcoded: bool = False):
+    """
+    İndirmenin tamamlandığını işaretler; tekrar denemede indirme adımı atlanır.
+    transcoded, dosyanın uyumlu formata dönüştürüldüğünü tekrar denemeye taşır.
+    """
+    try:
+        with open(marker_path, "w") as f:
+            json.dump({"file": file_name, "info": info, "transcoded": transcoded}, f)
+    except Exception as e:
+        logger.error("İndirme işareti kaydedilemedi: %s", e)
+
+@track_cpu_usage
+def _download_and_upload(
+    user_id: int,
+    user_data: dict,
+    download_type: str,
+    fmt_spec: str,
+    postprocessors: list,
+    download_file_name: str,
+    caption_file_name: str,
+    resolution: str,
+    required_space: int,
+    chat_id: int,
+    status_msg: types.Message,
+    log_message_ids: list = None,
+    cancel_token: CancelToken = None,
+    compatible: bool = False,
+    subtitle_langs: list = None,
+    chapter_mode: str = "off",
+) -> bool:
+    """
+    Seçilen formatı yt-dlp ile indirir, thumbnail hazırlar ve dosyayı yükler.
+    Tekil videolar ve oynatma listesi girdileri aynı yolu kullanır.
+    İndirilen/yüklenen bayt ve CPU süresi kullanıcının günlük kullanımına işlenir.
+    compatible True ise video gerekiyorsa H.264/AAC MP4'e dönüştürülür.
+    subtitle_langs verilirse altyazılar gömülür; chapter_mode "embed" bölüm bilgilerini dosyaya ekler,
+    "split" ise her bölümü ayrı dosya olarak gönderir.
+    """
+    compatible = compatible and download_type == "video"
+    if compatible:
+        fmt_spec = compatible_format_spec(fmt_spec)
+    chapters = user_data.get("chapters") if download_type == "video" and chapter_mode != "off" else None
+    if download_type == "video" and subtitle_langs:
+        postprocessors = postprocessors + [{"key": "FFmpegEmbedSubtitle", "already_have_subtitle": False}]
+    if chapters:
+        postprocessors = postprocessors + [{"key": "FFmpegMetadata", "add_chapters": True, "add_metadata": False}]
+    duration = user_data.get("duration") or 0
+    clip = user_data.get("clip")
+    if clip:
+        # Sadece kesite denk gelen kısım indirileceği için gereken alan orantılı olarak küçülür
+        clip_length = clip[1] - clip[0]
+        if required_space and duration:
+            required_space = int(required_space * min(1, clip_length / duration))
+        full_duration = duration
+        duration = clip_length
+    duration_str = format_duration(int(duration))
+
+    if not check_disk_space(required_space or 0):
         logger.error("Sistem hatası, yeterli disk alanı mevcut değil.")
         app.send_message(chat_id, "Sistem hatası, yeterli disk alanı mevcut değil.")
         return False
 
     try:
         logger.info("İndirme başladı...")
-        status_msg.edit_text("İndirme başladı...")
+        status_msg.edit_text("İndirme başladı...", reply_markup=cancel_markup(cancel_token))
     except Exception as e:
         logger.error("İndirme başlangıç mesajı güncellenemedi: %s", e)
 
-    last_progress_update = time.time()
+    # Video ve ses ayrı indirilip birleştirildiği için indirme, işleme ve yükleme tek ilerlemede gösterilir
+    tracker = ProgressTracker(status_msg, cancel_token, stages={
+        "download": ("İndiriliyor", 5),
+        "process": ("Dosya işleniyor", 1),
+        "upload": ("Yükleniyor", 4),
+    })
+    download_total_checked = False
 
     def progress_hook(d):
-        nonlocal last_progress_update
+        nonlocal download_total_checked
+        if cancel_token and cancel_token.cancelled:
+            raise yt_dlp.utils.DownloadCancelled()
         if d['status'] == 'downloading':
-            total = d.get('total_bytes') or d.get('total_bytes_estimate')
-            downloaded = d.get('downloaded_bytes', 0)
-            percent = (downloaded / total * 100) if total else 0
-            eta = d.get('eta', 0)
-            if time.time() - last_progress_update >= PROGRESS_UPDATE_INTERVAL:
-                last_progress_update = time.time()
-                try:
-                    logger.info(f"İndiriliyor: {percent:.2f}% - Kalan süre: {eta} sn")
-                    status_msg.edit_text(f"İndiriliyor: {percent:.2f}% - Kalan süre: {eta} sn")
-                except Exception as e:
-                    logger.error("İndirme güncelleme hatası: %s", e)
+            if not download_total_checked:
+                # Birleştirilecek formatların boyutları biliniyorsa aşamanın toplamı baştan belirlenir
+                download_total_checked = True
+                requested = (d.get('info_dict') or {}).get('requested_formats') or []
+                sizes = [f.get('filesize') or f.get('filesize_approx') for f in requested]
+                if sizes and all(sizes):
+                    tracker.set_total(sum(sizes))
+            tracker.update(d.get('downloaded_bytes', 0), d.get('total_bytes') or d.get('total_bytes_estimate'))
         elif d['status'] == 'finished':
-            try:
-                logger.info("İndirme tamamlandı, dosya işleniyor...")
-                status_msg.edit_text(f"İndirme tamamlandı, dosya işleniyor...")
-            except Exception as e:
-                logger.error("İndirme bitiş mesajı güncelleme hatası: %s", e)
+            tracker.finish_part(d.get('total_bytes') or d.get('downloaded_bytes', 0))
+
+    def postprocessor_hook(d):
+        if d['status'] != 'started':
+            return
+        # İptal edilen işte sıradaki ffmpeg adımı hiç başlatılmaz
+        if cancel_token and cancel_token.cancelled:
+            raise yt_dlp.utils.DownloadCancelled()
+        if tracker.stage != "process":
+            tracker.start_stage("process")
 
     ydl_opts = {
         'format': fmt_spec,
         'outtmpl': None,  # Daha sonra ayarlanacak
-        'quiet': True,
-        'no_warnings': True,
         'postprocessors': postprocessors,
-        'cookiefile': 'cookies.txt' if os.path.exists("cookies.txt") else None,
-        'logger': logger,
-        'progress_hooks': [progress_hook]
+        'progress_hooks': [progress_hook],
+        'postprocessor_hooks': [postprocessor_hook],
+        'retries': DOWNLOAD_RETRIES,
+        'fragment_retries': DOWNLOAD_RETRIES,
     }
     if download_type == "video":
         ydl_opts["merge_output_format"] = "mp4"
-
+        if subtitle_langs:
+            ydl_opts["writesubtitles"] = True
+            ydl_opts["subtitleslangs"] = subtitle_langs
+    if clip:
+        # yt-dlp yalnızca istenen aralığa denk gelen parçaları indirir, kesimler keyframe'lerden yapılır
+        ydl_opts["download_ranges"] = yt_dlp.utils.download_range_func(None, [clip])
+        ydl_opts["force_keyframes_at_cuts"] = False
+    if fair_scheduler.has_waiters() and usage_store.is_heavy(user_id):
+        # Sistem yoğunken günlük kullanımı yüksek kullanıcıların indirme hızı sınırlanır
+        logger.info("Kullanıcı %s için indirme hızı sınırlandı", user_id)
+        ydl_opts["ratelimit"] = HEAVY_USER_RATELIMIT
+
+    # Aynı sohbet/içerik/format/kesit için çalışma dizini sabittir, tekrar denemede kaldığı yerden devam edilir.
+    # Sohbet anahtarda olmazsa başka sohbete gönderilmiş parçalar bu sohbette atlanırdı.
+    work_key = f"{chat_id}|{user_data.get('url')}|{fmt_spec}|{clip}|{postprocessors}|{compatible}"
     download_success = False
-    with tempfile.TemporaryDirectory() as tmpdirname:
+    with job_work_dir(work_key) as work:
+        tmpdirname = work["path"]
+        if cancel_token:
+            cancel_token.register_path(tmpdirname)
+        marker_path = os.path.join(tmpdirname, ".complete.json")
         try:
             file_path = os.path.join(tmpdirname, download_file_name)
             ydl_opts['outtmpl'] = file_path
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.extract_info(user_data.get("url"), download=True)
+                marker = load_download_marker(marker_path)
+                resumed = bool(marker and os.path.exists(os.path.join(tmpdirname, marker["file"])))
+                if resumed:
+                    # Önceki denemede indirme tamamlanmıştı, yalnızca kalan adımlar yapılır
+                    logger.info("Daha önce indirilen dosya kullanılıyor: %s", marker["file"])
+                    info = marker["info"]
+                else:
+                    for attempt in range(DOWNLOAD_RETRIES + 1):
+                        try:
+                            # yt-dlp varsayılan olarak yarım kalan .part dosyalarından devam eder
+                            with ydl_pool.download(ydl_opts) as ydl:
+                                info = ydl.extract_info(user_data.get("url"), download=True)
+                            break
+                        except Exception as e:
+                            if (cancel_token and cancel_token.cancelled) or attempt == DOWNLOAD_RETRIES:
+                                raise
+                            logger.warning("İndirme başarısız (%s), tekrar denenecek (%d/%d)", e, attempt + 1, DOWNLOAD_RETRIES)
+                            if backoff_wait(attempt, cancel_token):
+                                raise JobCancelled()
+                    info = {k: info.get(k) for k in ("title", "duration", "thumbnail")} if info else None
                 download_success = True
                 file_path = os.path.join(tmpdirname, caption_file_name)
+                if not user_data.get("title") and info:
+                    # Menü atlandı: başlık, süre ve thumbnail indirme sırasında öğrenildi
+                    user_data["title"] = info.get("title", "Video")
+                    user_data["thumbnail"] = info.get("thumbnail")
+                    if not clip:
+                        duration = info.get("duration") or 0
+                        duration_str = format_duration(int(duration))
+                    title = sanitize_filename(user_data["title"]) or "video"
+                    if clip:
+                        title += f" ({format_clip(clip).replace(':', '.')})"
+                    caption_file_name = title + os.path.splitext(caption_file_name)[1]
+                    if os.path.exists(file_path):
+                        renamed_path = os.path.join(tmpdirname, caption_file_name)
+                        os.replace(file_path, renamed_path)
+                        file_path = renamed_path
+                if resumed:
+                    caption_file_name = marker["file"]
+                    file_path = os.path.join(tmpdirname, caption_file_name)
             except Exception as e:
+                if cancel_token and cancel_token.cancelled:
+                    raise JobCancelled()
                 logger.error("İndirme sırasında hata: %s", e)
                 try:
                     status_msg.edit_text("İndirme sırasında hata oluştu.")
@@ -890,6 +3048,66 @@ def _process_task(user_id: int, download_type: str, selection: str, chat_id: int
                     logger.error("Dosya bulunamadı mesajı güncelleme hatası: %s", e)
                 return False
 
+            if cancel_token:
+                cancel_token.check()
+
+            # Önceki denemede dönüştürülmüş dosya tekrar dönüştürülmez ama etiketi korunur
+            transcoded = bool(resumed and marker.get("transcoded"))
+            if not resumed:
+                save_download_marker(marker_path, caption_file_name, info)
+
+            if clip:
+                # İndirilen dosya kesitten belirgin şekilde uzunsa (aralık desteklenmediyse
+                # ya da önceki keyframe'den başladıysa) stream copy ile kırpılır.
+                try:
+                    actual_duration = float(ffmpeg.probe(file_path)["format"]["duration"])
+                except Exception as e:
+                    logger.error("Kesit süresi ffmpeg ile hesaplanamadı: %s", e)
+                    actual_duration = 0
+                if actual_duration > clip_length + 1:
+                    if full_duration and actual_duration >= full_duration - 1:
+                        offset = clip[0]
+                    else:
+                        offset = actual_duration - clip_length
+                    trim_to_clip(file_path, offset, clip_length)
+                    try:
+                        actual_duration = float(ffmpeg.probe(file_path)["format"]["duration"])
+                    except Exception:
+                        pass
+                if actual_duration:
+                    duration = int(actual_duration)
+                    duration_str = format_duration(duration)
+
+            if compatible:
+                def transcode():
+                    # Etiket iş havuzda gerçekten başladığında güncellenir
+                    tracker.start_stage("process", label="Uyumlu formata dönüştürülüyor")
+                    return make_compatible(file_path, cancel_token)
+
+                tracker.start_stage("process", label="Dönüştürme sırası bekleniyor")
+                future = transcode_executor.submit(transcode)
+                try:
+                    if future.result():
+                        transcoded = True
+                        save_download_marker(marker_path, caption_file_name, info, transcoded=True)
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    logger.error("Dönüştürme sırasında hata: %s", e)
+                    try:
+                        status_msg.edit_text("Dönüştürme sırasında hata oluştu.")
+                    except Exception as ex:
+                        logger.error("Hata mesajı güncelleme hatası: %s", ex)
+                    return False
+                if transcoded:
+                    resolution = f"{resolution} (uyumlu)"
+
+            try:
+                if not resumed:
+                    usage_store.add(user_id, bytes_down=os.path.getsize(file_path))
+            except Exception as e:
+                logger.error("İndirme kullanımı kaydedilemedi: %s", e)
+
             # Thumbnail indirimi
             thumb_file_path = None
             thumb_url = user_data.get("thumbnail")
@@ -933,10 +3151,32 @@ def _process_task(user_id: int, download_type: str, selection: str, chat_id: int
                 logger.error("Dosya boyutu hesaplanamadı: %e", e)
                 real_file_size_str = "0 MB"
             quality_line = f"Kalite: {resolution}, Boyut: {real_file_size_str} Format: {os.path.splitext(caption_file_name)[1][1:]}, Süre: {duration_str}"
+            if clip:
+                quality_line += f", Kesit: {format_clip(clip)}"
             caption = f"{caption_file_name}\n{quality_line}\n{user_data.get('url')}"
 
-            if(upload_file(file_path, status_msg, download_type, chat_id, caption, duration, caption_file_name, tmpdirname, thumb_file_path)):
-                        logger.info("Dosya yüklendi")
+            if chapters and chapter_mode == "split":
+                uploaded = upload_chapters(
+                    file_path, chapters, chat_id, status_msg, caption_file_name, resolution,
+                    user_data.get("url"), tmpdirname, thumb_file_path, log_message_ids=log_message_ids,
+                    equal_split=user_store.equal_split(user_id), cancel_token=cancel_token
+                )
+            else:
+                uploaded = upload_file(
+                    file_path, status_msg, download_type, chat_id, caption, int(duration),
+                    caption_file_name, tmpdirname, thumb_file_path, log_message_ids=log_message_ids,
+                    equal_split=user_store.equal_split(user_id), cancel_token=cancel_token,
+                    progress_tracker=tracker
+                )
+            if cancel_token:
+                cancel_token.check()
+            if uploaded:
+                logger.info("Dosya yüklendi")
+                usage_store.add(user_id, bytes_up=os.path.getsize(file_path))
+                work["keep"] = False
+            return uploaded
+        except JobCancelled:
+            raise
         except Exception as e:
             logger.error("İşlem sırasında beklenmeyen hata: %s", e)
             try:
@@ -944,6 +3184,105 @@ def _process_task(user_id: int, download_type: str, selection: str, chat_id: int
             except Exception as ex:
                 logger.error("Hata mesajı güncelleme hatası: %s", ex)
             return False
+
+def _process_playlist(user_id: int, user_data: dict, profile: str, chat_id: int, status_msg: types.Message, cancel_token: CancelToken = None) -> bool:
+    """
+    Oynatma listesi girdilerini sınırlı sayıda paralel işçiyle indirip yükler.
+    Daha önce aynı profille yüklenmiş girdiler LOG_CHANNEL'dan kopyalanır.
+    """
+    if profile not in PLAYLIST_PROFILES:
+        app.send_message(chat_id, "Bilinmeyen profil.")
+        return False
+    entries = user_data.get("entries", [])
+    total = len(entries)
+    audio_codec = user_store.audio_codec(user_id)
+    compatible = user_store.compatible(user_id) and profile != "audio"
+    summary = {"done": 0, "cached": 0, "failed": 0, "skipped": 0}
+    summary_lock = threading.Lock()
+    quota_reached = threading.Event()
+    last_summary_update = 0
+
+    def update_summary(force: bool = False):
+        nonlocal last_summary_update
+        with summary_lock:
+            finished = sum(summary.values())
+            if not force and time.time() - last_summary_update < PROGRESS_UPDATE_INTERVAL:
+                return
+            last_summary_update = time.time()
+            text = (
+                f"{user_data.get('title')}\n"
+                f"İlerleme: {finished}/{total} - Yüklenen: {summary['done']}, "
+                f"Önbellekten: {summary['cached']}, Hatalı: {summary['failed']}"
+            )
+            if summary["skipped"]:
+                text += f", Kota nedeniyle atlanan: {summary['skipped']}"
+        try:
+            logger.info(text.replace("\n", " - "))
+            status_msg.edit_text(text, reply_markup=cancel_markup(cancel_token))
+        except Exception as e:
+            logger.error("Oynatma listesi özeti güncellenemedi: %s", e)
+
+    def process_entry(index_entry):
+        index, entry = index_entry
+        if cancel_token and cancel_token.cancelled:
+            return
+        cache_key = f"{entry['id']}|{profile if profile != 'audio' else 'audio-' + audio_codec}"
+        if compatible:
+            cache_key += "-compat"
+        if send_from_upload_cache(cache_key, chat_id):
+            result = "cached"
+        elif quota_reached.is_set() or usage_store.over_quota(user_id):
+            # Kota her girdiden önce kontrol edilir, tek bir liste günlük kotayı aşamaz
+            if not quota_reached.is_set():
+                quota_reached.set()
+                logger.info("Kullanıcı %s oynatma listesi sırasında günlük kotasını doldurdu", user_id)
+            result = "skipped"
+        else:
+            title = sanitize_filename(entry["title"])
+            (download_type, fmt_spec, postprocessors, download_file_name,
+             caption_file_name, resolution) = build_profile_job(profile, title, audio_codec)
+            entry_msg = app.send_message(chat_id, f"{index}/{total} sırada: {entry['title']}")
+            log_message_ids = []
+            ok = False
+            try:
+                ok = _download_and_upload(
+                    user_id, entry, download_type, fmt_spec, postprocessors, download_file_name,
+                    caption_file_name, resolution, 0, chat_id, entry_msg,
+                    log_message_ids=log_message_ids, cancel_token=cancel_token, compatible=compatible
+                )
+            except JobCancelled:
+                try:
+                    entry_msg.edit_text(f"{index}/{total} iptal edildi: {entry['title']}")
+                except Exception as e:
+                    logger.error("İptal mesajı güncellenemedi: %s", e)
+                return
+            except Exception as e:
+                logger.error("Oynatma listesi girdisi işlenirken hata: %s", e)
+            if ok:
+                if log_message_ids:
+                    save_upload_cache(cache_key, log_message_ids)
+                try:
+                    entry_msg.delete()
+                except Exception as e:
+                    logger.error("Mesaj silinirken hata: %s", e)
+            result = "done" if ok else "failed"
+        with summary_lock:
+            summary[result] += 1
+        update_summary()
+
+    update_summary(force=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, PLAYLIST_CONCURRENCY)) as executor:
+        list(executor.map(process_entry, enumerate(entries, start=1)))
+    if cancel_token:
+        cancel_token.check()
+
+    text = (
+        f"{user_data.get('title')} tamamlandı.\n"
+        f"Yüklenen: {summary['done']}, Önbellekten: {summary['cached']}, Hatalı: {summary['failed']} (toplam {total})"
+    )
+    if summary["skipped"]:
+        text += f"\nGünlük indirme kotanız dolduğu için {summary['skipped']} girdi atlandı, lütfen yarın tekrar deneyin."
+    app.send_message(chat_id, text)
     return True
 
 def check_next(user_id: int):
@@ -952,13 +3291,130 @@ def check_next(user_id: int):
     if queue:
         next_task = queue.pop(0)
         user_video_info[user_id] = next_task["data"]
-        process_task(user_id, next_task["download_type"], next_task["selection"], next_task["chat_id"], next_task["status_msg"])
+        process_task(
+            user_id, next_task["download_type"], next_task["selection"], next_task["chat_id"],
+            next_task["status_msg"], next_task["cancel_token"]
+        )
         if not queue:
             user_queue.pop(user_id, None)
     else:
         user_busy[user_id] = False
         user_video_info.pop(user_id, None)
 
+def enqueue_or_start(user_id: int, chat_id: int, download_type: str, selection: str, status_msg: types.Message = None) -> bool:
+    """
+    Kullanıcının devam eden işi yoksa işi hemen başlatır, varsa kuyruğa ekler.
+    status_msg verilmemişse başlatılan iş için yeni bir durum mesajı gönderilir.
+    İş hemen başlatıldıysa True döner.
+    """
+    cancel_token = CancelToken(user_id)
+    active_jobs[cancel_token.job_id] = cancel_token
+    if user_busy.get(user_id, False):
+        queue = user_queue.setdefault(user_id, [])
+        logger.info(f"Devam eden işlemin tamamlanması bekleniyor, sıranız: {len(queue)+1}")
+        queued_msg = app.send_message(
+            chat_id, f"Devam eden işlemin tamamlanması bekleniyor, sıranız: {len(queue)+1}",
+            reply_markup=cancel_markup(cancel_token)
+        )
+        task = {
+            "download_type": download_type,
+            "selection": selection,
+            "chat_id": chat_id,
+            "data": copy.deepcopy(user_video_info[user_id]),
+            "status_msg": queued_msg,
+            "cancel_token": cancel_token
+        }
+        queue.append(task)
+        return False
+    user_busy[user_id] = True
+    if status_msg is None:
+        status_msg = app.send_message(chat_id, "İşleminiz başlatıldı...", reply_markup=cancel_markup(cancel_token))
+    threading.Thread(
+        target=process_task,
+        args=(user_id, download_type, selection, chat_id, status_msg, cancel_token),
+        daemon=True
+    ).start()
+    return True
+
+@app.on_callback_query(filters.regex(r"^cancel\|"))
+def cancel_callback(client, callback_query):
+    try:
+        job_id = int(callback_query.data.split("|", 1)[1])
+    except (IndexError, ValueError):
+        callback_query.answer("Geçersiz seçim.")
+        return
+    cancel_token = active_jobs.get(job_id)
+    if cancel_token is None:
+        callback_query.answer("Bu işlem zaten tamamlandı.")
+        return
+    if callback_query.from_user.id not in (cancel_token.user_id, OWNER_ID):
+        callback_query.answer("Bu işlemi iptal etmeye yetkiniz yok.")
+        return
+    logger.info("İşlem %s iptal ediliyor", job_id)
+    cancel_token.cancel()
+    callback_query.answer("İşlem iptal ediliyor...")
+    try:
+        callback_query.message.edit_text("İşlem iptal ediliyor...", reply_markup=None)
+    except Exception as e:
+        logger.error("İptal mesajı güncellenemedi: %s", e)
+
+@app.on_callback_query(filters.regex(r"^option\|"))
+def menu_option_callback(client, callback_query):
+    user_data = user_video_info.get(callback_query.from_user.id)
+    if not user_data or user_data.get("selection_made"):
+        callback_query.answer("İşlem bilgileri bulunamadı.")
+        return
+    option = callback_query.data.split("|", 1)[1]
+    if option == "compat":
+        user_data["compatible"] = not user_data.get("compatible")
+        answer = "Uyumlu mod açıldı." if user_data["compatible"] else "Uyumlu mod kapatıldı."
+    elif option == "subs":
+        user_data["embed_subs"] = not user_data.get("embed_subs")
+        answer = "Altyazılar eklenecek." if user_data["embed_subs"] else "Altyazılar eklenmeyecek."
+    elif option == "chapters":
+        modes = list(CHAPTER_MODES)
+        user_data["chapter_mode"] = modes[(modes.index(user_data.get("chapter_mode", "off")) + 1) % len(modes)]
+        answer = f"Bölümler: {CHAPTER_MODES[user_data['chapter_mode']]}"
+    else:
+        callback_query.answer("Geçersiz seçim.")
+        return
+    # Kalite düğmeleri korunur, seçenek satırları yeni durumla yeniden oluşturulur
+    keyboard = [
+        row for row in callback_query.message.reply_markup.inline_keyboard
+        if not any((button.callback_data or "").startswith("option|") for button in row)
+    ]
+    keyboard.extend(menu_option_buttons(user_data))
+    try:
+        callback_query.message.edit_reply_markup(types.InlineKeyboardMarkup(keyboard))
+    except Exception as e:
+        logger.error("Seçenek düğmeleri güncellenemedi: %s", e)
+    callback_query.answer(answer)
+
+@app.on_callback_query(filters.regex(r"^retry\|"))
+def retry_callback(client, callback_query):
+    try:
+        job_id = int(callback_query.data.split("|", 1)[1])
+    except (IndexError, ValueError):
+        callback_query.answer("Geçersiz seçim.")
+        return
+    job = retry_jobs.get(job_id)
+    if job is None:
+        callback_query.answer("Bu işlemin tekrar deneme süresi doldu.", show_alert=True)
+        return
+    if callback_query.from_user.id != job["user_id"]:
+        callback_query.answer("Bu işlemi tekrar denemeye yetkiniz yok.")
+        return
+    if usage_store.over_quota(job["user_id"]):
+        callback_query.answer("Günlük indirme kotanız doldu.", show_alert=True)
+        return
+    retry_jobs.pop(job_id, None)
+    logger.info("İşlem %s tekrar deneniyor", job_id)
+    user_video_info[job["user_id"]] = copy.deepcopy(job["data"])
+    if enqueue_or_start(job["user_id"], job["chat_id"], job["download_type"], job["selection"], callback_query.message):
+        callback_query.answer("İşlem tekrar başlatıldı...")
+    else:
+        callback_query.answer("İşlem sıraya alındı.")
+
 @app.on_callback_query()
 def quality_chosen(client, callback_query):
     if callback_query.data == "ignore":
@@ -972,24 +3428,43 @@ def quality_chosen(client, callback_query):
         return
     user_id = callback_query.from_user.id
     chat_id = callback_query.message.chat.id
-    if user_busy.get(user_id, False):
-        queue = user_queue.setdefault(user_id, [])
-        logger.info(f"Devam eden işlemin tamamlanması bekleniyor, sıranız: {len(queue)+1}")
-        status_msg = app.send_message(chat_id, f"Devam eden işlemin tamamlanması bekleniyor, sıranız: {len(queue)+1}")
-        task = {
-            "download_type": download_type,
-            "selection": selection,
-            "chat_id": chat_id,
-            "data": copy.deepcopy(user_video_info[user_id]),
-            "status_msg": status_msg
-        }
-        queue.append(task)
-    else:
-        user_busy[user_id] = True
+    if usage_store.over_quota(user_id):
+        callback_query.answer("Günlük indirme kotanız doldu.", show_alert=True)
+        return
+    menu_timer = user_video_info.get(user_id, {}).pop("menu_timer", None)
+    if menu_timer:
+        menu_timer.cancel()
+    if enqueue_or_start(user_id, chat_id, download_type, selection, callback_query.message):
         logger.info("İşleminiz başlatıldı...")
         callback_query.answer("İşleminiz başlatıldı...")
-        threading.Thread(target=process_task, args=(user_id, download_type, selection, chat_id, callback_query.message), daemon=True).start()
+
+def prewarm():
+    """
+    Bot çevrimiçi olduktan sonra ağır modülleri yükler ve bilgi çıkarmada kullanılan havuz örneğini
+    YouTube extractor'ı hazır şekilde oluşturur; ilk istek bu bekleme olmadan işlenir.
+    """
+    started = time.monotonic()
+    try:
+        for module in (yt_dlp, ffmpeg, requests, Image):
+            module.load()
+        with ydl_pool.acquire(VIDEO_INFO_OPTS) as ydl:
+            ydl.get_info_extractor("Youtube")
+        logger.info("Ön ısıtma %.2f saniyede tamamlandı.", time.monotonic() - started)
+    except Exception as e:
+        logger.error("Ön ısıtma sırasında hata: %s", e)
 
 if __name__ == "__main__":
-    logger.info("Bot çalışmaya başladı...")
-    app.run()
+    threading.Thread(target=user_store.watch, daemon=True).start()
+    app.start()
+    logger.info("Bot %.2f saniyede çalışmaya başladı...", time.monotonic() - startup_started)
+    # Çerezler ve ön ısıtma açılışı bekletmeden arka planda yapılır
+    threading.Thread(target=cookie_manager.run, daemon=True).start()
+    threading.Thread(target=prewarm, daemon=True).start()
+    threading.Thread(target=cleanup_stale_work_dirs, daemon=True).start()
+    # Premium hesap ana iş parçacığında başlatılmalı: pyrogram'ın senkron sarmalayıcısı başka bir
+    # iş parçacığında geçici bir olay döngüsü açar ve istemcinin ağ görevleri o döngüyle birlikte ölür
+    start_userbot()
+    idle()
+    if userbot is not None and userbot.is_connected:
+        userbot.stop()
+    app.stop()